@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Offline tests for va_service: a quote_service on a free localhost port, with
+a thread pool whose solves wait at a gate until every request is in.
+
+    python -m unittest test_va_service
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import threading
+import time
+import unittest
+
+import va_service
+
+
+class gated_executor(ThreadPoolExecutor):
+    #Holds every submitted job until gate is set, so requests overlap.
+    def __init__(self, gate):
+        ThreadPoolExecutor.__init__(self, max_workers=2)
+        self.gate = gate
+
+    def submit(self, fn, *args, **kwargs):
+        def held():
+            self.gate.wait()
+            return fn(*args, **kwargs)
+        return ThreadPoolExecutor.submit(self, held)
+
+
+async def post(port, payload):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    body = json.dumps(payload).encode('utf-8')
+    writer.write(b'POST /quote HTTP/1.1\r\nHost: localhost\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+
+class quote_service_test(unittest.TestCase):
+    def run_service(self, test, gate=None):
+        gate = gate or threading.Event()
+        service = va_service.quote_service(executor=gated_executor(gate))
+
+        async def main():
+            server = await service.start('127.0.0.1', 0)
+            try:
+                return await test(service, server.sockets[0].getsockname()[1], gate)
+            finally:
+                server.close()
+                await server.wait_closed()
+        try:
+            return asyncio.run(main())
+        finally:
+            gate.set()
+            service.close()
+
+    def test_identical_requests_coalesce(self):
+        payload = {'scenario1': {'initial_amount': 1000000}, 'scenario2': {}, 'deadline_ms': 5000}
+
+        async def test(service, port, gate):
+            requests = [asyncio.ensure_future(post(port, payload)) for i in range(5)]
+            while service.solves + service.coalesced < 10:
+                await asyncio.sleep(0.01)
+            gate.set()
+            return await asyncio.gather(*requests), service.solves, service.coalesced
+        replies, solves, coalesced = self.run_service(test)
+        self.assertEqual([status for status, reply in replies], [200]*5)
+        self.assertEqual(solves, 2)
+        self.assertEqual(coalesced, 8)
+        distributions = set(reply['scenario1']['distribution'] for status, reply in replies)
+        self.assertEqual(len(distributions), 1)
+
+    def test_longer_budget_does_not_join_shorter(self):
+        async def test(service, port, gate):
+            short = asyncio.ensure_future(post(port, {'scenario1': {}, 'deadline_ms': 200}))
+            while service.solves < 1:
+                await asyncio.sleep(0.01)
+            long = asyncio.ensure_future(post(port, {'scenario1': {}, 'deadline_ms': 5000}))
+            while service.solves < 2:
+                await asyncio.sleep(0.01)
+            status, reply = await short
+            gate.set()
+            return status, await long, service.coalesced
+        status, (long_status, reply), coalesced = self.run_service(test)
+        self.assertEqual(status, 504)
+        self.assertEqual(long_status, 200)
+        self.assertEqual(coalesced, 0)
+        self.assertTrue(reply['scenario1']['converged'])
+
+    def test_queued_solve_is_skipped_after_deadline(self):
+        self.assertIsNone(va_service.quote_scenario('scenario1', {}, 10, time.monotonic() - 1))
+
+    def test_bad_parameters(self):
+        async def test(service, port, gate):
+            gate.set()
+            return await post(port, {'scenario1': {'muni_roi': 2}})
+        status, reply = self.run_service(test)
+        self.assertEqual(status, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
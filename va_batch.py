@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming batch runs over many clients.
+
+iter_results runs one client at a time and yields its tables as soon as they
+are computed, then drops the client, so memory stays flat however many
+clients are in the batch. run_batch pushes the chunks into a sink (a
+callback, incremental CSV files or a va_store file). Because the generator is
+pulled by the sink, a slow sink simply slows the computation down. A client
+that fails is reported as a 'failed' chunk and the batch carries on.
+"""
+
+from collections import namedtuple
+import csv
+import os
+import random
+
+import va_core
+from va_metrics import logger
+from va_scenariocalculator import scenario_one, scenario_two, scenario_params
+
+SCENARIOS = {'scenario1': scenario_one, 'scenario2': scenario_two}
+
+#One table (first10, dists or distributions) for one client.
+#columns is an ordered dict of column name -> list, 'Starting Year' first.
+#metrics is the client's solve_metrics.as_dict() on the distributions chunk, None otherwise.
+#A client that raises ends with a 'failed' chunk: no columns, metrics {'error': message}.
+result_chunk = namedtuple('result_chunk', ['client_id', 'scenario', 'table', 'params', 'columns', 'metrics'])
+
+
+def make_client(scenario, **params):
+    """Creates a scenario_one or scenario_two instance from 'scenario1'/'scenario2' and its parameters."""
+    return SCENARIOS[scenario](**params)
+
+
+def scenario_name(client):
+    for name, cls in SCENARIOS.items():
+        if isinstance(client, cls):
+            return name
+    raise ValueError("Unknown scenario type %s." % type(client).__name__)
+
+
+def frame_columns(df):
+    columns = {df.index.name or 'Starting Year': df.index.tolist()}
+    for col in df.columns:
+        columns[col] = df[col].tolist()
+    return columns
+
+
+def iter_results(clients, years_inv=10, years_dist=10, engine='reference', verify_rate=0.0, rng=None, index=None):
+    """
+    Yields result_chunks client by client.
+
+    clients is an iterable of (client_id, client) pairs, where client is a
+    scenario_one or scenario_two instance or a va_core.scenario_config. Pass
+    a generator to avoid building the whole roster up front, e.g.
+    ((cid, make_client('scenario1', initial_amount=amt)) for cid, amt in rows)
+    or va_roster.roster_clients(...).
+
+    engine is 'reference' (the scenario classes and goal_seek) or 'fast'
+    (va_core). With the fast engine, verify_rate (0-1) of the clients are
+    also run through the reference path with va_verify; failures are logged
+    and every report is attached to the client's metrics. index, a
+    va_brackets.bracket_index_file, records each client's tax brackets
+    (fast engine only).
+
+    The first10 chunk is yielded before the distribution solve starts. If a
+    client raises (e.g. parameters the original arithmetic cannot solve),
+    the error is logged, a 'failed' chunk is yielded for it, after any of
+    its chunks already yielded, and the batch goes on with the next client.
+    """
+    rng = rng or random
+    for client_id, client in clients:
+        if isinstance(client, va_core.scenario_config):
+            name = client.kind
+            params = client.params()
+        else:
+            name = scenario_name(client)
+            params = scenario_params(client)
+        try:
+            for chunk in _client_chunks(client_id, client, name, params, years_inv, years_dist, engine, verify_rate, rng, index):
+                yield chunk
+        except Exception as e:
+            logger.warning("Client %s failed: %s: %s", client_id, type(e).__name__, e)
+            yield result_chunk(client_id, name, 'failed', params, {}, {'error': '%s: %s' % (type(e).__name__, e)})
+
+
+def _client_chunks(client_id, client, name, params, years_inv, years_dist, engine, verify_rate, rng, index):
+    #The chunks of one client, see iter_results.
+    if isinstance(client, va_core.scenario_config) and engine != 'fast':
+        client = make_client(name, **params)
+    if engine == 'fast':
+        #With an index, the brackets are recorded as the engine looks them up.
+        incomes = [] if index is not None else None
+        first10 = va_core.first10(name, params, years_inv, incomes)
+        yield result_chunk(client_id, name, 'first10', params, first10, None)
+        distribution, sim, evaluations, converged = va_core.solve(name, va_core.rates_of(params), va_core.start_state(first10),
+                                                                  years_dist, trace=index is not None)
+        dist_df, dist_info = va_core.dist_tables(sim, years_inv)
+        metrics = {'engine': 'fast', 'simulations': evaluations, 'distribution': distribution,
+                   'residual': sim['residual'], 'converged': converged}
+        if index is not None:
+            index.add(client_id, name, incomes + sim['trace'])
+        from va_verify import should_verify, verify_client
+        if should_verify(verify_rate, rng):
+            report = verify_client(name, params, years_dist)
+            metrics['verify'] = report
+            if not report['ok']:
+                logger.warning("Fast engine diverges from goal_seek for client %s: %s", client_id, ', '.join(report['failures']))
+        yield result_chunk(client_id, name, 'dists', params, dist_df, None)
+        yield result_chunk(client_id, name, 'distributions', params, dist_info, metrics)
+    else:
+        first10 = client.total_returns(years_inv)
+        yield result_chunk(client_id, name, 'first10', params, frame_columns(first10), None)
+        dist_df, dist_info = client.distributions(years_dist)
+        yield result_chunk(client_id, name, 'dists', params, frame_columns(dist_df), None)
+        yield result_chunk(client_id, name, 'distributions', params, frame_columns(dist_info), dict(client.metrics.as_dict(), engine='reference'))
+
+
+def run_batch(clients, sink, years_inv=10, years_dist=10, **kwargs):
+    """
+    Streams every client's results into sink and closes it. If the run
+    raises, a sink with an abort() method (store_sink) is aborted instead,
+    so it does not look complete.
+    Extra keyword arguments (engine, verify_rate, index) go to iter_results.
+    Returns the number of clients processed.
+    """
+    count = 0
+    last_client = None
+    try:
+        for chunk in iter_results(clients, years_inv, years_dist, **kwargs):
+            sink.write(chunk)
+            if chunk.client_id != last_client:
+                count += 1
+                last_client = chunk.client_id
+    except BaseException:
+        getattr(sink, 'abort', sink.close)()
+        raise
+    sink.close()
+    return count
+
+
+class callback_sink(object):
+    def __init__(self, callback):
+        """Calls callback(chunk) for each result_chunk."""
+        self.callback = callback
+
+    def write(self, chunk):
+        self.callback(chunk)
+
+    def close(self):
+        pass
+
+
+class tee_sink(object):
+    def __init__(self, *sinks):
+        """Writes every chunk to each of sinks, in order."""
+        self.sinks = sinks
+
+    def write(self, chunk):
+        for sink in self.sinks:
+            sink.write(chunk)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def abort(self):
+        for sink in self.sinks:
+            getattr(sink, 'abort', sink.close)()
+
+
+class csv_sink(object):
+    def __init__(self, directory, prefix='batch'):
+        """
+        Appends chunks to one CSV per table and scenario (e.g.
+        batch_distributions_scenario2.csv), with client_id and scenario
+        columns in front; the scenarios have different first10 columns, so
+        they cannot share a header. Failed clients go to batch_failed.csv
+        with their error. Each chunk is flushed as soon as it is written.
+        """
+        self.directory = directory
+        self.prefix = prefix
+        self._files = {}
+
+    def _file(self, name, header):
+        if name not in self._files:
+            path = os.path.join(self.directory, '%s_%s.csv' % (self.prefix, name))
+            fh = open(path, 'w', newline='')
+            writer = csv.writer(fh)
+            writer.writerow(header)
+            self._files[name] = (fh, writer, header)
+        fh, writer, expected = self._files[name]
+        if header != expected:
+            raise ValueError("Client columns %s do not match %s_%s.csv." % (', '.join(header[2:]), self.prefix, name))
+        return fh, writer
+
+    def write(self, chunk):
+        if chunk.table == 'failed':
+            fh, writer = self._file('failed', ['client_id', 'scenario', 'error'])
+            writer.writerow([chunk.client_id, chunk.scenario, chunk.metrics['error']])
+        else:
+            fh, writer = self._file('%s_%s' % (chunk.table, chunk.scenario), ['client_id', 'scenario'] + list(chunk.columns))
+            for row in zip(*chunk.columns.values()):
+                writer.writerow([chunk.client_id, chunk.scenario] + list(row))
+        fh.flush()
+
+    def close(self):
+        for fh, writer, header in self._files.values():
+            fh.close()
+        self._files = {}
+
+
+class store_sink(object):
+    def __init__(self, path, metadata=None):
+        """Appends each chunk as a partition of a va_store file."""
+        from va_store import store_writer
+        meta = {'tax_schedule_version': va_core.TAX_SCHEDULE_VERSION}
+        meta.update(metadata or {})
+        self.store = store_writer(path, meta)
+
+    def write(self, chunk):
+        #A failed client is an empty 'failed' partition carrying the error.
+        attrs = chunk.metrics if chunk.table == 'failed' else None
+        self.store.append(chunk.table, chunk.columns, chunk.client_id, chunk.scenario, chunk.params, attrs)
+
+    def close(self):
+        self.store.close()
+
+    def abort(self):
+        self.store.abort()
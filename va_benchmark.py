@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the scenario calculator.
+
+Times each computational stage separately (investment_calc, total_returns,
+distributions/goal_seek, combine_csvs, after_tax_compare and the whole
+client run) on fixed workloads, and records throughput and peak memory.
+Results are written to a JSON file so runs can be compared across commits:
+
+    python va_benchmark.py --out bench_new.json --compare bench_old.json
+
+Workloads are deterministic: 'default' is scenario_one() and scenario_two()
+with their default arguments, the roster workloads spread initial_amount and
+proportion over a fixed grid. The reference total_returns/distributions
+assume a 10 year investment and 10 year distribution horizon, so the long
+horizon workloads (e.g. 'horizon_30', 30 years of each) only run the
+benchmarks that take a horizon, the fast engine ones.
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+#name -> function(workload) returning the list of client specs
+WORKLOADS = {}
+#workload name -> (years_inv, years_dist)
+HORIZONS = {}
+#name -> (setup(specs) -> state, run(state) -> units processed, unit name, horizons)
+#With horizons, setup also takes years_inv and years_dist.
+BENCHMARKS = {}
+
+DEFAULT_HORIZON = (10, 10)
+
+
+def workload(name, years_inv=10, years_dist=10):
+    def register(fn):
+        WORKLOADS[name] = fn
+        HORIZONS[name] = (years_inv, years_dist)
+        return fn
+    return register
+
+
+def add_benchmark(name, setup, run, unit='clients', horizons=False):
+    BENCHMARKS[name] = (setup, run, unit, horizons)
+
+
+def roster(n):
+    """n client specs alternating between the two scenarios over a fixed grid of amounts and proportions."""
+    specs = []
+    for i in range(n):
+        amount = 500000 + (i * 37500) % 1500000
+        proportion = 30 + (i * 10) % 50
+        if i % 2 == 0:
+            specs.append(('scenario1', {'initial_amount': amount, 'proportion': proportion}))
+        else:
+            specs.append(('scenario2', {'initial_amount': amount, 'reserve_fund': round(amount/5, 2), 'proportion': proportion}))
+    return specs
+
+
+@workload('default')
+def default_workload():
+    return [('scenario1', {}), ('scenario2', {})]
+
+
+@workload('roster_20')
+def roster_20():
+    return roster(20)
+
+
+@workload('roster_100')
+def roster_100():
+    return roster(100)
+
+
+@workload('horizon_30', years_inv=30, years_dist=30)
+def horizon_30():
+    return roster(20)
+
+
+@workload('horizon_50', years_inv=50, years_dist=50)
+def horizon_50():
+    return roster(20)
+
+
+def make_clients(specs):
+    from va_batch import make_client
+    return [make_client(scenario, **params) for scenario, params in specs]
+
+
+def solved_clients(specs):
+    clients = make_clients(specs)
+    results = []
+    for client in clients:
+        first10 = client.total_returns()
+        dist_df, dist_info = client.distributions()
+        results.append((client, first10, dist_df, dist_info))
+    return results
+
+
+def _investment_calc_run(clients, calls=1000):
+    for client in clients:
+        investment = [client.initial_amount/2, client.initial_amount/2]
+        for i in range(calls):
+            client.investment_calc(investment)
+    return len(clients) * calls
+
+
+add_benchmark('investment_calc', make_clients, _investment_calc_run, unit='calls')
+
+
+def _total_returns_run(clients):
+    for client in clients:
+        client.total_returns()
+    return len(clients)
+
+
+add_benchmark('total_returns', make_clients, _total_returns_run)
+
+
+def _distributions_setup(specs):
+    clients = make_clients(specs)
+    for client in clients:
+        client.total_returns()
+    return clients
+
+
+def _distributions_run(clients):
+    for client in clients:
+        client.distributions()
+    return len(clients)
+
+
+add_benchmark('distributions', _distributions_setup, _distributions_run)
+
+
+def _combine_csvs_run(results):
+    from va_scenariocalculator import combine_csvs
+    for client, first10, dist_df, dist_info in results:
+        combine_csvs(first10, dist_df)
+    return len(results)
+
+
+add_benchmark('combine_csvs', solved_clients, _combine_csvs_run)
+
+
+def _after_tax_compare_run(results):
+    from va_scenariocalculator import after_tax_compare
+    infos = [dist_info for client, first10, dist_df, dist_info in results]
+    for i in range(0, len(infos) - 1, 2):
+        after_tax_compare(infos[i], infos[i + 1])
+    return len(infos) // 2
+
+
+add_benchmark('after_tax_compare', solved_clients, _after_tax_compare_run, unit='pairs')
+
+
+def _end_to_end_run(specs):
+    from va_scenariocalculator import combine_csvs
+    for client in make_clients(specs):
+        first10 = client.total_returns()
+        dist_df, dist_info = client.distributions()
+        combine_csvs(first10, dist_df)
+    return len(specs)
+
+
+add_benchmark('end_to_end', lambda specs: specs, _end_to_end_run)
+
+
+def _fast_total_returns_run(state):
+    import va_core
+    specs, years_inv = state
+    for scenario, params in specs:
+        va_core.first10(scenario, params, years_inv)
+    return len(specs)
+
+
+add_benchmark('fast_total_returns', lambda specs, years_inv, years_dist: (specs, years_inv), _fast_total_returns_run,
+              horizons=True)
+
+
+def _fast_solve_setup(specs, years_inv, years_dist):
+    import va_core
+    states = []
+    for scenario, params in specs:
+        p = dict(va_core.DEFAULTS[scenario])
+        p.update(params)
+        states.append((scenario, va_core.rates_of(p), va_core.start_state(va_core.first10(scenario, p, years_inv)), years_dist))
+    return states
+
+
+def _fast_solve_run(states):
+    import va_core
+    for scenario, rates, start, years_dist in states:
+        va_core.solve(scenario, rates, start, years_dist)
+    return len(states)
+
+
+add_benchmark('fast_solve', _fast_solve_setup, _fast_solve_run, horizons=True)
+
+
+def time_benchmark(name, specs, repeat=3, horizon=DEFAULT_HORIZON):
+    """
+    Runs one benchmark on one workload. Timings exclude setup; peak memory is
+    measured with tracemalloc on one extra run so it does not skew the timings.
+    horizon is (years_inv, years_dist), for the benchmarks that take one.
+    """
+    setup, run, unit, horizons = BENCHMARKS[name]
+    if horizons:
+        make_state = lambda: setup(specs, *horizon)
+    elif tuple(horizon) != DEFAULT_HORIZON:
+        raise ValueError("Benchmark %s only runs the %d/%d year horizon." % ((name,) + DEFAULT_HORIZON))
+    else:
+        make_state = lambda: setup(specs)
+    times = []
+    units = 0
+    for i in range(repeat):
+        state = make_state()
+        start = time.perf_counter()
+        units = run(state)
+        times.append(time.perf_counter() - start)
+    state = make_state()
+    tracemalloc.start()
+    run(state)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    best = min(times)
+    return {'benchmark': name,
+            'unit': unit,
+            'units': units,
+            'repeat': repeat,
+            'seconds_min': best,
+            'seconds_median': sorted(times)[len(times) // 2],
+            'throughput_per_sec': units / best if best > 0 else None,
+            'peak_memory_bytes': peak}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(workloads=None, benchmarks=None, repeat=3):
+    results = []
+    for wname in workloads or ['default', 'roster_20']:
+        specs = WORKLOADS[wname]()
+        horizon = HORIZONS[wname]
+        for bname in benchmarks or list(BENCHMARKS):
+            if horizon != DEFAULT_HORIZON and not BENCHMARKS[bname][3]:
+                #the reference path is fixed at 10/10 years
+                continue
+            result = time_benchmark(bname, specs, repeat, horizon)
+            result['workload'] = wname
+            result['clients'] = len(specs)
+            result['years_inv'], result['years_dist'] = horizon
+            results.append(result)
+    return {'commit': git_commit(),
+            'timestamp': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results}
+
+
+def compare(new, old):
+    """Prints new/old time ratios for every benchmark present in both runs."""
+    old_times = {(r['workload'], r['benchmark']): r['seconds_min'] for r in old['results']}
+    print("%-12s %-20s %12s %12s %8s" % ('workload', 'benchmark', 'old (s)', 'new (s)', 'speedup'))
+    for r in new['results']:
+        key = (r['workload'], r['benchmark'])
+        if key in old_times:
+            speedup = old_times[key] / r['seconds_min'] if r['seconds_min'] > 0 else float('inf')
+            print("%-12s %-20s %12.4f %12.4f %7.2fx" % (key[0], key[1], old_times[key], r['seconds_min'], speedup))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Benchmark every computational stage of the calculator.')
+    parser.add_argument('--workload', action = 'append', choices = sorted(WORKLOADS),
+                        help = 'Workload to run, can be repeated. Defaults to default and roster_20.')
+    parser.add_argument('--benchmark', action = 'append', choices = sorted(BENCHMARKS),
+                        help = 'Benchmark to run, can be repeated. Defaults to all.')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--out', default = 'benchmark_results.json')
+    parser.add_argument('--compare', help = 'Earlier results file to compare against.')
+    args = parser.parse_args()
+
+    suite = run_suite(args.workload, args.benchmark, args.repeat)
+    with open(args.out, 'w') as fh:
+        json.dump(suite, fh, indent = 2)
+    for r in suite['results']:
+        print("%-12s %-20s %10.4fs %12.1f %s/s  peak %.1f MB" % (r['workload'], r['benchmark'], r['seconds_min'],
+              r['throughput_per_sec'] or 0, r['unit'], r['peak_memory_bytes'] / 1e6))
+    if args.compare:
+        with open(args.compare) as fh:
+            compare(suite, json.load(fh))
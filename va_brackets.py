@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Affected-client index for tax schedule changes.
+
+A client's results depend on the tax schedule only through the taxable
+income (interest + dividends) of each year it is invested: the first
+years_inv years and every year of the solved distribution path. If a new
+schedule taxes each of those incomes exactly like the old one, simulating
+the client at its solved distribution gives the same numbers, so the old
+solution stands.
+
+bracket_index_file keeps, per client, the taxable income of every year on
+its solved path (float64) and the schedule row it landed in (one byte per
+year), together with the schedules it was built with. The incomes are the
+ones the engine looked up while solving (va_core.solve_config(...,
+trace=True)), not a second simulation. The schedules tracked are
+va_core.STATE_SCHEDULE and va_core.CORP_SCHEDULE, which both engines'
+investment_calc read. After one of them is edited, affected() lists the
+clients with a year in an income band whose treatment changed, and
+recompute() solves only those:
+
+    python va_brackets.py build roster.csv --out book.vabrk
+    python va_brackets.py affected book.vabrk
+"""
+
+from array import array
+import json
+import sys
+
+import va_core
+
+INDEX_VERSION = 1
+
+#Schedule each scenario's investment_calc looks up, by va_core attribute name.
+SCHEDULES = {'scenario1': 'STATE_SCHEDULE', 'scenario2': 'CORP_SCHEDULE'}
+
+
+def current_schedules():
+    return {kind: tuple(tuple(row) for row in getattr(va_core, name)) for kind, name in SCHEDULES.items()}
+
+
+def client_path(kind, params, distribution, years_inv=10, years_dist=10):
+    """
+    Taxable income of every year on the client's path at the solved
+    distribution, by simulating it again. For results solved without trace.
+    """
+    incomes = []
+    columns = va_core.first10(kind, params, years_inv, trace=incomes)
+    p = dict(va_core.DEFAULTS[kind])
+    p.update(params)
+    va_core.simulate(kind, va_core.rates_of(p), va_core.start_state(columns), distribution, years_dist, trace=incomes)
+    return incomes
+
+
+def _terms(schedule, income):
+    #Everything about a row except its upper bound.
+    return tuple(schedule[va_core.bracket_index(schedule, income)][1:])
+
+
+def changed_bands(old, new):
+    """
+    Income bands (low, high] taxed differently by the two schedules, merged
+    where they touch. low None is minus infinity, high None is infinity.
+    """
+    edges = sorted(set(row[0] for row in old + new if row[0] is not None))
+    bands = []
+    lows = [None] + edges
+    highs = edges + [None]
+    for low, high in zip(lows, highs):
+        #Both schedules pick one row for the whole band, so any income in it will do.
+        probe = high if high is not None else (low + 1 if low is not None else 0)
+        if _terms(old, probe) == _terms(new, probe):
+            continue
+        if bands and bands[-1][1] == low:
+            bands[-1] = (bands[-1][0], high)
+        else:
+            bands.append((low, high))
+    return bands
+
+
+def in_bands(income, bands):
+    for low, high in bands:
+        if (low is None or income > low) and (high is None or income <= high):
+            return True
+    return False
+
+
+def _rows_touching(schedule, bands):
+    #Rows of schedule whose income range overlaps one of the bands.
+    rows = set()
+    low = None
+    for i, row in enumerate(schedule):
+        high = row[0]
+        for band_low, band_high in bands:
+            if ((band_high is None or low is None or band_high > low) and
+                    (high is None or band_low is None or band_low < high)):
+                rows.add(i)
+        low = high
+    return rows
+
+
+class bracket_index_file(object):
+    def __init__(self, schedules=None, version=None, years_inv=10, years_dist=10):
+        """
+        schedules defaults to the current va_core schedules. Every client in
+        the index is solved over the same years_inv and years_dist.
+        """
+        self.schedules = schedules or current_schedules()
+        self.version = version or va_core.TAX_SCHEDULE_VERSION
+        self.years_inv = years_inv
+        self.years_dist = years_dist
+        #client_id -> (scenario, array('d') of incomes, bytes of schedule rows)
+        self.clients = {}
+
+    def add(self, client_id, kind, incomes):
+        schedule = self.schedules[kind]
+        self.clients[client_id] = (kind, array('d', incomes),
+                                   bytes(va_core.bracket_index(schedule, income) for income in incomes))
+
+    def record(self, client_id, result):
+        """
+        Adds a client from its va_core.solve_result, solved with trace=True
+        (otherwise its path is simulated again with client_path).
+        """
+        incomes = result.incomes
+        if incomes is None:
+            incomes = client_path(result.config.kind, result.config.params(), result.distribution, self.years_inv, self.years_dist)
+        self.add(client_id, result.config.kind, incomes)
+
+    def affected(self, schedules=None):
+        """
+        Client ids whose path has a year in a band that schedules (the
+        current va_core ones by default) tax differently from the index's.
+        """
+        schedules = schedules or current_schedules()
+        out = []
+        for kind, old in self.schedules.items():
+            bands = changed_bands(old, schedules[kind])
+            if not bands:
+                continue
+            #A client can only be affected if it landed in an old row the bands touch.
+            rows = [bytes([r]) for r in _rows_touching(old, bands)]
+            for client_id, (client_kind, incomes, path) in self.clients.items():
+                if client_kind != kind or not any(r in path for r in rows):
+                    continue
+                if any(in_bands(income, bands) for income in incomes):
+                    out.append(client_id)
+        return out
+
+    def recompute(self, configs, schedules=None, version=None):
+        """
+        Solves the affected clients again and moves the index to the new
+        schedules. configs maps client_id -> va_core.scenario_config for
+        (at least) every client in the index. Returns {client_id: solve_result}
+        for the clients that were recomputed.
+        """
+        schedules = schedules or current_schedules()
+        affected = self.affected(schedules)
+        results = {}
+        for client_id in affected:
+            results[client_id] = va_core.solve_config(configs[client_id], self.years_inv, self.years_dist, trace=True)
+        self.schedules = schedules
+        self.version = version or va_core.TAX_SCHEDULE_VERSION
+        for client_id, (kind, incomes, path) in list(self.clients.items()):
+            if client_id in results:
+                self.record(client_id, results[client_id])
+            else:
+                #Same incomes, but row numbers can move when rows are added or removed.
+                self.add(client_id, kind, incomes)
+        return results
+
+    def save(self, path):
+        header = {'version': INDEX_VERSION,
+                  'tax_schedule_version': self.version,
+                  'schedules': self.schedules,
+                  'years_inv': self.years_inv,
+                  'years_dist': self.years_dist,
+                  'clients': [[client_id, kind, len(incomes)] for client_id, (kind, incomes, rows) in self.clients.items()]}
+        incomes = array('d')
+        rows = bytearray()
+        for kind, client_incomes, client_rows in self.clients.values():
+            incomes.extend(client_incomes)
+            rows.extend(client_rows)
+        if sys.byteorder != 'little':
+            incomes.byteswap()
+        with open(path, 'wb') as fh:
+            fh.write(json.dumps(header).encode('utf-8') + b'\n')
+            incomes.tofile(fh)
+            fh.write(rows)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as fh:
+            header = json.loads(fh.readline().decode('utf-8'))
+            if header.get('version') != INDEX_VERSION:
+                raise ValueError("%s is not a bracket index." % path)
+            total = sum(n for client_id, kind, n in header['clients'])
+            incomes = array('d')
+            try:
+                incomes.fromfile(fh, total)
+            except EOFError:
+                raise ValueError("%s is truncated." % path)
+            rows = fh.read(total)
+        if sys.byteorder != 'little':
+            incomes.byteswap()
+        if len(rows) != total:
+            raise ValueError("%s is truncated." % path)
+        schedules = {kind: tuple(tuple(row) for row in schedule) for kind, schedule in header['schedules'].items()}
+        index = cls(schedules, header['tax_schedule_version'], header['years_inv'], header['years_dist'])
+        offset = 0
+        for client_id, kind, n in header['clients']:
+            index.clients[client_id] = (kind, incomes[offset:offset + n], rows[offset:offset + n])
+            offset += n
+        return index
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Find the clients a tax schedule change affects.')
+    sub = parser.add_subparsers(dest = 'command')
+    build = sub.add_parser('build', help = 'Solve a roster and save its bracket index.')
+    build.add_argument('roster')
+    build.add_argument('--out', required = True)
+    build.add_argument('--rejects', default = 'rejects.csv')
+    affected = sub.add_parser('affected', help = 'List clients the current schedules affect.')
+    affected.add_argument('index')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        from va_roster import roster_reader, roster_clients
+        index = bracket_index_file()
+        for client_id, config in roster_clients(roster_reader(args.roster, args.rejects)):
+            index.record(client_id, va_core.solve_config(config, index.years_inv, index.years_dist, trace=True))
+        index.save(args.out)
+        print("%d clients indexed under schedule version %s" % (len(index.clients), index.version))
+    elif args.command == 'affected':
+        index = bracket_index_file.load(args.index)
+        clients = index.affected()
+        for client_id in clients:
+            print(client_id)
+        print("%d of %d clients affected" % (len(clients), len(index.clients)), file = sys.stderr)
+    else:
+        parser.print_help()
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Command line entry point.
+
+    python va_cli.py run --scenario scenario2 --set initial_amount=1200000 --set reserve_fund=240000
+    python va_cli.py sweep --scenario scenario1 --vary proportion --values 0:100:10
+    python va_cli.py compare --set1 initial_amount=1000000 --set2 initial_amount=950000
+    python va_cli.py export --format csv --dir out/
+
+run, sweep and compare use the fast engine (va_core) and only import the
+standard library, so a call from cron starts in milliseconds. export runs the
+reference calculator and writes the viz CSVs or a store file; it is the only
+subcommand that imports pandas.
+
+run and compare print JSON by default and a CSV table with --csv; sweep
+always prints CSV, one row per value. Arguments outside va_core.check_params
+stop run, compare and export with a one line message; in a sweep, a value
+that cannot be solved gets a row with its error instead.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import math
+import sys
+
+import va_core
+
+
+def parse_assignments(items, kind):
+    """['initial_amount=1e6', ...] -> {'initial_amount': 1000000.0, ...}, checked against the scenario's arguments."""
+    params = {}
+    for item in items or []:
+        name, sep, value = item.partition('=')
+        name = name.strip()
+        if not sep or name not in va_core.DEFAULTS[kind]:
+            raise SystemExit("Bad --set %r, expected one of %s as name=value." % (item, ', '.join(sorted(va_core.DEFAULTS[kind]))))
+        try:
+            params[name] = float(value)
+        except ValueError:
+            raise SystemExit("Bad --set %r, %s is not a number." % (item, value))
+    return params
+
+
+def checked_params(items, kind, option='--set'):
+    """parse_assignments, then va_core.check_params; exits with a one line message if they are out of range."""
+    params = parse_assignments(items, kind)
+    try:
+        va_core.check_params(kind, params)
+    except ValueError as e:
+        raise SystemExit("Bad %s for %s: %s" % (option, kind, e))
+    return params
+
+
+def solve_or_exit(config, years_inv, years_dist):
+    try:
+        return va_core.solve_config(config, years_inv, years_dist)
+    except (ArithmeticError, IndexError) as e:
+        raise SystemExit("%s cannot be solved with %s: %s: %s" % (config.kind, config.params(), type(e).__name__, e))
+
+
+def _json_safe(values):
+    return [None if isinstance(v, float) and math.isnan(v) else v for v in values]
+
+
+def write_table(columns, out=sys.stdout):
+    """Writes a dict of equal length column lists as CSV, header first."""
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(list(columns))
+    writer.writerows(zip(*columns.values()))
+
+
+def summary(result):
+    return {'scenario': result.config.kind,
+            'params': result.config.params(),
+            'distribution': result.distribution,
+            'residual': result.residual,
+            'converged': result.converged,
+            'evaluations': result.evaluations}
+
+
+def cmd_run(args):
+    config = va_core.scenario_config(args.scenario, **checked_params(args.set, args.scenario))
+    result = solve_or_exit(config, args.years_inv, args.years_dist)
+    table = getattr(result, args.table)
+    if args.csv:
+        write_table(table)
+        return
+    out = summary(result)
+    out[args.table] = {col: _json_safe(list(values)) for col, values in table.items()}
+    json.dump(out, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+def cmd_sweep(args):
+    from va_surface import parse_range
+    config = va_core.scenario_config(args.scenario, **parse_assignments(args.set, args.scenario))
+    if args.vary not in va_core.DEFAULTS[args.scenario]:
+        raise SystemExit("Cannot vary %s, expected one of %s." % (args.vary, ', '.join(sorted(va_core.DEFAULTS[args.scenario]))))
+    writer = csv.writer(sys.stdout, lineterminator='\n')
+    writer.writerow([args.vary, 'distribution', 'after_tax_income_total', 'converged', 'evaluations', 'error'])
+    distribution = 0
+    for value in parse_range(args.values):
+        point = config.replace(**{args.vary: value})
+        try:
+            va_core.check_params(args.scenario, point.params())
+            #warm start from the previous value's distribution
+            result = va_core.solve_config(point, args.years_inv, args.years_dist, distribution)
+        except (ValueError, ArithmeticError, IndexError) as e:
+            writer.writerow([value, '', '', False, 0, '%s: %s' % (type(e).__name__, e)])
+            continue
+        distribution = result.distribution
+        income = sum(v for v in result.info['after_tax_income'] if not math.isnan(v))
+        writer.writerow([value, result.distribution, income, result.converged, result.evaluations, ''])
+
+
+def cmd_compare(args):
+    results = [solve_or_exit(va_core.scenario_config(kind, **checked_params(items, kind, option)), args.years_inv, args.years_dist)
+               for kind, items, option in (('scenario1', args.set1, '--set1'), ('scenario2', args.set2, '--set2'))]
+    income = va_core.after_tax_compare(results[0].info, results[1].info)
+    if args.csv:
+        write_table(income)
+        return
+    json.dump({'scenario1': summary(results[0]),
+               'scenario2': summary(results[1]),
+               'income': {col: _json_safe(values) for col, values in income.items()},
+               'difference_total': sum(income['difference_income'])}, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+def cmd_export(args):
+    from va_scenariocalculator import run_scenarios, export_csvs, export_store, log_stage_times
+    from va_metrics import solve_metrics
+    report = solve_metrics()
+    runs, after_tax = run_scenarios(checked_params(args.set1, 'scenario1', '--set1'), checked_params(args.set2, 'scenario2', '--set2'),
+                                    metrics = report)
+    if args.format == 'store':
+        export_store(args.out, runs, after_tax)
+    else:
+        export_csvs(runs, after_tax, args.dir)
+    log_stage_times(runs, report)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description = 'Scenario calculator.')
+    sub = parser.add_subparsers(dest = 'command')
+
+    def horizon(p):
+        p.add_argument('--years-inv', type = int, default = 10)
+        p.add_argument('--years-dist', type = int, default = 10)
+
+    run = sub.add_parser('run', help = 'Solve one scenario.')
+    run.add_argument('--scenario', choices = sorted(va_core.DEFAULTS), default = 'scenario1')
+    run.add_argument('--set', action = 'append', metavar = 'NAME=VALUE', help = 'Scenario argument, can be repeated.')
+    run.add_argument('--table', choices = ['info', 'dists', 'first10'], default = 'info')
+    run.add_argument('--csv', action = 'store_true', help = 'Print the table as CSV instead of JSON.')
+    horizon(run)
+    run.set_defaults(func = cmd_run)
+
+    sweep = sub.add_parser('sweep', help = 'Solve one scenario over a range of one argument.')
+    sweep.add_argument('--scenario', choices = sorted(va_core.DEFAULTS), default = 'scenario1')
+    sweep.add_argument('--set', action = 'append', metavar = 'NAME=VALUE', help = 'Fixed scenario argument, can be repeated.')
+    sweep.add_argument('--vary', required = True, help = 'Argument to sweep, e.g. initial_amount.')
+    sweep.add_argument('--values', required = True, help = 'start:stop:step or a comma separated list.')
+    horizon(sweep)
+    sweep.set_defaults(func = cmd_sweep)
+
+    compare = sub.add_parser('compare', help = 'After tax income of scenario one against scenario two.')
+    compare.add_argument('--set1', action = 'append', metavar = 'NAME=VALUE', help = 'Scenario one argument.')
+    compare.add_argument('--set2', action = 'append', metavar = 'NAME=VALUE', help = 'Scenario two argument.')
+    compare.add_argument('--csv', action = 'store_true', help = 'Print the income table as CSV instead of JSON.')
+    horizon(compare)
+    compare.set_defaults(func = cmd_compare)
+
+    export = sub.add_parser('export', help = 'Run the reference calculator and write the viz CSVs or a store file.')
+    export.add_argument('--set1', action = 'append', metavar = 'NAME=VALUE', help = 'Scenario one argument.')
+    export.add_argument('--set2', action = 'append', metavar = 'NAME=VALUE', help = 'Scenario two argument.')
+    export.add_argument('--format', choices = ['csv', 'store'], default = 'csv')
+    export.add_argument('--dir', default = '.', help = 'Directory for --format csv.')
+    export.add_argument('--out', default = 'scenarios.vastore', help = 'Output file for --format store.')
+    export.set_defaults(func = cmd_export)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    #Stage times and progress (export) go to stderr, like the va_scenariocalculator script.
+    logging.basicConfig(level = logging.INFO, format = '%(message)s')
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
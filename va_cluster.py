@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+Coordinator/worker mode for solving a book across processes and hosts.
+
+The coordinator splits the roster into work units of consecutive rows
+(client_id, scenario, params) and serves them over a
+multiprocessing.connection socket. Workers, local processes or on other
+hosts, connect, pull a unit, solve it with va_core and send back compact
+arrays. The coordinator merges them in roster order, so the result is the
+same, bit for bit, as solve_unit() over the whole roster in one process.
+
+Protocol (pickled tuples, authenticated with a shared key):
+
+    worker -> ('ready', None), ('result', unit_id, arrays) or
+              ('error', unit_id, message) if the unit could not be solved
+    coordinator -> ('unit', unit_id, specs, years_inv, years_dist),
+                   ('wait', seconds) while the last units are still out,
+                   ('stop',) when everything is in
+
+A client whose solve raises is listed in the unit's failed entry and the
+rest of the unit carries on. A unit whose worker reports an error or
+disconnects before answering goes back in the queue, up to max_attempts
+times; after that its clients are listed as failed and the run finishes
+without them.
+
+Messages are pickles, so anyone holding the key can run code on the
+coordinator: there is no default key (--authkey or $VA_CLUSTER_KEY), and
+the coordinator listens on 127.0.0.1 unless given --host.
+
+    export VA_CLUSTER_KEY=...
+    python va_cluster.py coordinator --workload roster_100 --host 0.0.0.0 --port 8766
+    python va_cluster.py worker --host coordinator-host --port 8766
+    python va_cluster.py local --workload roster_100 --workers 4 --check
+"""
+
+from array import array
+from collections import deque
+import multiprocessing
+from multiprocessing.connection import Client, Listener
+import os
+import threading
+import time
+
+import va_core
+from va_metrics import logger
+
+INFO = ('Starting Year',) + va_core.INFO_COLUMNS
+
+
+def solve_unit(specs, years_inv=10, years_dist=10):
+    """
+    Solves (client_id, scenario, params) specs. Returns a dict of arrays:
+    one entry per client in distribution, residual, converged, evaluations
+    and rows (dist_info rows of the client), and the dist_info columns
+    of every client one after the other in info. Clients whose solve
+    raises are left out and listed in failed as (client_id, scenario, error).
+    """
+    out = {'client_id': [],
+           'failed': [],
+           'scenario': [],
+           'distribution': array('d'),
+           'residual': array('d'),
+           'converged': array('b'),
+           'evaluations': array('l'),
+           'rows': array('l'),
+           'info': {col: array('d') for col in INFO}}
+    for client_id, kind, params in specs:
+        try:
+            result = va_core.solve_config(va_core.scenario_config(kind, **params), years_inv, years_dist)
+        except Exception as e:
+            out['failed'].append((client_id, kind, '%s: %s' % (type(e).__name__, e)))
+            continue
+        out['client_id'].append(client_id)
+        out['scenario'].append(kind)
+        out['distribution'].append(result.distribution)
+        out['residual'].append(result.residual)
+        out['converged'].append(bool(result.converged))
+        out['evaluations'].append(result.evaluations)
+        out['rows'].append(len(result.info['dists']))
+        for col in INFO:
+            out['info'][col].extend(result.info[col])
+    return out
+
+
+def merge(parts):
+    """Concatenates solve_unit outputs, in the order given."""
+    merged = solve_unit([])
+    for part in parts:
+        for key, value in part.items():
+            if key == 'info':
+                for col in INFO:
+                    merged['info'][col].extend(value[col])
+            else:
+                merged[key].extend(value)
+    return merged
+
+
+def same_results(a, b):
+    """True if two solve_unit outputs are identical to the bit."""
+    for key in a:
+        if key == 'info':
+            if any(a['info'][col].tobytes() != b['info'][col].tobytes() for col in INFO):
+                return False
+        elif isinstance(a[key], array):
+            if a[key].tobytes() != b[key].tobytes():
+                return False
+        elif a[key] != b[key]:
+            return False
+    return True
+
+
+def split_units(specs, unit_size):
+    return [specs[i:i + unit_size] for i in range(0, len(specs), unit_size)]
+
+
+class coordinator(object):
+    def __init__(self, specs, address, authkey, unit_size=50, years_inv=10, years_dist=10, max_attempts=3):
+        """
+        specs is the roster as a list of (client_id, scenario, params).
+        Port 0 picks a free port; the bound address is in self.address.
+        A unit is handed out at most max_attempts times.
+        """
+        if not authkey:
+            raise ValueError("coordinator needs an authkey.")
+        self.units = split_units(list(specs), unit_size)
+        self.years_inv = years_inv
+        self.years_dist = years_dist
+        self.max_attempts = max_attempts
+        #unit_id -> times it failed (error or disconnect), unit_id -> last error once it is given up
+        self.attempts = {}
+        self.failed = {}
+        self.listener = Listener(address, authkey=authkey)
+        self.address = self.listener.address
+        self.pending = deque(range(len(self.units)))
+        self.results = {}
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        #workers connected right now, so run() can tell them to stop before returning
+        self.connected = 0
+        self.idle = threading.Condition(self.lock)
+        if not self.units:
+            self.done.set()
+
+    def _next_unit(self):
+        with self.lock:
+            if self.pending:
+                return self.pending.popleft()
+        return None
+
+    def _finished(self):
+        #Call with the lock held.
+        if len(self.results) + len(self.failed) == len(self.units):
+            self.done.set()
+
+    def _retry(self, unit_id, error):
+        #Call with the lock held. Requeues the unit, or gives it up after max_attempts.
+        if unit_id in self.results or unit_id in self.failed:
+            return
+        self.attempts[unit_id] = self.attempts.get(unit_id, 0) + 1
+        if self.attempts[unit_id] >= self.max_attempts:
+            logger.error("Giving up unit %d after %d attempts: %s", unit_id, self.attempts[unit_id], error)
+            self.failed[unit_id] = error
+            self._finished()
+        else:
+            self.pending.append(unit_id)
+
+    def _serve(self, conn):
+        current = None
+        with self.lock:
+            self.connected += 1
+        try:
+            while True:
+                message = conn.recv()
+                if message[0] == 'result':
+                    unit_id, arrays = message[1], message[2]
+                    with self.lock:
+                        self.results[unit_id] = arrays
+                        self._finished()
+                    current = None
+                elif message[0] == 'error':
+                    logger.warning("Unit %d failed on a worker: %s", message[1], message[2])
+                    with self.lock:
+                        self._retry(message[1], message[2])
+                    current = None
+                if self.done.is_set():
+                    conn.send(('stop',))
+                    break
+                current = self._next_unit()
+                if current is None:
+                    conn.send(('wait', 0.05))
+                else:
+                    conn.send(('unit', current, self.units[current], self.years_inv, self.years_dist))
+        except (EOFError, OSError):
+            logger.warning("Worker disconnected%s.", '' if current is None else ', requeueing unit %d' % current)
+        finally:
+            with self.lock:
+                if current is not None:
+                    self._retry(current, "worker disconnected")
+                self.connected -= 1
+                self.idle.notify_all()
+            conn.close()
+
+    def _accept(self):
+        while not self.done.is_set():
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                break
+            except Exception:
+                #e.g. a client with the wrong authkey
+                logger.exception("Rejected a worker connection.")
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def run(self, timeout=None, grace=5.0):
+        """
+        Serves units until every result is in or given up, then returns the
+        merged arrays; the clients of units given up are in failed with the
+        unit's last error. Waits up to grace seconds for connected workers
+        to be told to stop.
+        """
+        threading.Thread(target=self._accept, daemon=True).start()
+        if not self.done.wait(timeout):
+            raise TimeoutError("%d of %d units done." % (len(self.results) + len(self.failed), len(self.units)))
+        self.listener.close()
+        with self.idle:
+            self.idle.wait_for(lambda: self.connected == 0, grace)
+        parts = []
+        for i in range(len(self.units)):
+            if i in self.results:
+                parts.append(self.results[i])
+            else:
+                part = solve_unit([])
+                part['failed'] = [(spec[0], spec[1], self.failed[i]) for spec in self.units[i]]
+                parts.append(part)
+        return merge(parts)
+
+
+def worker(address, authkey):
+    """Pulls and solves units from the coordinator at address until told to stop. Returns the units solved."""
+    conn = Client(tuple(address), authkey=authkey)
+    solved = 0
+    try:
+        conn.send(('ready', None))
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                logger.warning("Coordinator closed the connection.")
+                break
+            if message[0] == 'stop':
+                break
+            if message[0] == 'wait':
+                time.sleep(message[1])
+                conn.send(('ready', None))
+                continue
+            command, unit_id, specs, years_inv, years_dist = message
+            try:
+                arrays = solve_unit(specs, years_inv, years_dist)
+            except Exception as e:
+                #Report it and stay connected rather than take the unit down with the worker.
+                logger.exception("Unit %d failed.", unit_id)
+                conn.send(('error', unit_id, '%s: %s' % (type(e).__name__, e)))
+                continue
+            conn.send(('result', unit_id, arrays))
+            solved += 1
+    finally:
+        conn.close()
+    return solved
+
+
+def run_local(specs, workers=2, unit_size=50, years_inv=10, years_dist=10, authkey=None):
+    """
+    Runs a coordinator with workers local worker processes and returns the
+    merged arrays. Without an authkey a random one is made for this run.
+    """
+    if authkey is None:
+        authkey = os.urandom(32)
+    coord = coordinator(specs, ('127.0.0.1', 0), authkey, unit_size, years_inv, years_dist)
+    #Not forked: a forked worker would inherit the listening socket.
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    context = multiprocessing.get_context(method)
+    procs = [context.Process(target=worker, args=(coord.address, authkey)) for i in range(workers)]
+    for p in procs:
+        p.start()
+    try:
+        return coord.run()
+    finally:
+        for p in procs:
+            p.join()
+
+
+def workload_specs(name):
+    from va_benchmark import WORKLOADS
+    return [('%s_%d' % (name, i), kind, params) for i, (kind, params) in enumerate(WORKLOADS[name]())]
+
+
+def roster_specs(path):
+    from va_roster import roster_reader, roster_clients
+    return [(client_id, config.kind, config.params()) for client_id, config in roster_clients(roster_reader(path))]
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Solve a book across worker processes and hosts.')
+    parser.add_argument('--authkey', default = os.environ.get('VA_CLUSTER_KEY'),
+                        help = 'Shared key, defaults to $VA_CLUSTER_KEY. Required for coordinator and worker; '
+                               'local makes a random one.')
+    sub = parser.add_subparsers(dest = 'command')
+
+    def book(p):
+        group = p.add_mutually_exclusive_group()
+        group.add_argument('--workload', default = 'roster_100', help = 'va_benchmark workload.')
+        group.add_argument('--roster', help = 'Roster CSV (see va_roster).')
+        p.add_argument('--unit-size', type = int, default = 50, help = 'Roster rows per work unit.')
+
+    coord_parser = sub.add_parser('coordinator', help = 'Serve work units to workers.')
+    book(coord_parser)
+    coord_parser.add_argument('--host', default = '127.0.0.1', help = 'Interface to listen on, e.g. 0.0.0.0 for other hosts.')
+    coord_parser.add_argument('--port', type = int, default = 8766)
+    worker_parser = sub.add_parser('worker', help = 'Pull and solve work units.')
+    worker_parser.add_argument('--host', default = '127.0.0.1')
+    worker_parser.add_argument('--port', type = int, default = 8766)
+    local_parser = sub.add_parser('local', help = 'Coordinator plus local worker processes.')
+    book(local_parser)
+    local_parser.add_argument('--workers', type = int, default = 2)
+    local_parser.add_argument('--check', action = 'store_true', help = 'Compare with a single-process run.')
+    args = parser.parse_args()
+    if args.command in ('coordinator', 'worker') and not args.authkey:
+        parser.error("give --authkey or set VA_CLUSTER_KEY")
+    authkey = args.authkey.encode('utf-8') if args.authkey else None
+
+    if args.command == 'worker':
+        print("%d units solved" % worker((args.host, args.port), authkey))
+    elif args.command in ('coordinator', 'local'):
+        specs = roster_specs(args.roster) if args.roster else workload_specs(args.workload)
+        start = time.perf_counter()
+        if args.command == 'coordinator':
+            coord = coordinator(specs, (args.host, args.port), authkey, args.unit_size)
+            print("Serving %d units on %s:%d" % (len(coord.units), coord.address[0], coord.address[1]))
+            merged = coord.run()
+        else:
+            merged = run_local(specs, args.workers, args.unit_size, authkey = authkey)
+        print("%d clients in %.2fs, %d not converged, %d failed" % (len(merged['client_id']), time.perf_counter() - start,
+              len(merged['converged']) - sum(merged['converged']), len(merged['failed'])))
+        for client_id, kind, error in merged['failed'][:10]:
+            print("  %s (%s): %s" % (client_id, kind, error))
+        if args.command == 'local' and args.check:
+            single = solve_unit(specs)
+            print("matches single process run" if same_results(merged, single) else "DIFFERS from single process run")
+    else:
+        parser.print_help()
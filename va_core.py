@@ -0,0 +1,627 @@
+# -*- coding: utf-8 -*-
+"""
+Fast calculation engine, no pandas.
+
+The functions here reproduce scenario_one/scenario_two arithmetic step for
+step on plain lists (same rounding, same order of operations, same quirks),
+so a simulation at a given distribution matches goal_seek to the cent. What
+is faster is the search: goal_seek walks the distribution in fixed steps and
+builds two DataFrames per step, solve() brackets the root and uses
+false position, building nothing until it is done.
+
+Tax schedules are kept as data so they can be versioned and compared; the
+reference calculator reads them from here too.
+"""
+
+from array import array
+import math
+import time
+
+#Bumped whenever a tax schedule below changes, saved with exported results.
+#scenario_one/scenario_two.investment_calc and va_brackets read the same tables.
+TAX_SCHEDULE_VERSION = '2017.1'
+
+#Scenario one, state tax on interest + dividends.
+#(upper bound of interest + dividends, muni interest rate %, dividend rate % incl. 20% + 3.8% ACA)
+STATE_SCHEDULE = (
+    (3000, 2, 20+3.8+2),
+    (5000, 3, 20+3.8+3),
+    (17000, 5, 20+3.8+5),
+    (None, 5.75, 20+3.8+5.75),
+)
+
+#Scenario two, 831(b) corporate tax.
+#(upper bound of interest + dividends, amount deducted (split by muni share) or None, rate %)
+CORP_SCHEDULE = (
+    (50000, None, 15),
+    (75000, 7500, 25),
+    (100000, 13750, 34),
+    (335000, 22250, 39),
+    (10000000, 113900, 34),
+    (15000000, 3400000, 35),
+    (18333333, 5150000, 38),
+    (None, None, 35),
+)
+
+CAPGAIN_ADJUSTER = 1-(20)/100
+
+DIST_COLUMNS = ('muni_start', 'muni_cost', 'muni_end_amt', 'net_int', 'eq_start', 'equity_cost', 'equity_end_amt', 'net_div')
+INFO_COLUMNS = ('dists', 'nondivint_dists', 'capgains_paid', 'after_tax_income')
+
+
+def bracket_index(schedule, income):
+    for i, row in enumerate(schedule):
+        if row[0] is None or income <= row[0]:
+            return i
+    return len(schedule) - 1
+
+
+def taxable_income(rates, muni, equity):
+    """Interest + dividends for the year, the amount calc_one/calc_two look up in their schedule."""
+    muni_roi, equity_roi, muni_int, equity_div = rates
+    return round(equity*equity_div,2) + round(muni*muni_int,2)
+
+
+def _traced(calc, trace):
+    #Wraps calc to append each year's taxable income to trace.
+    def traced(rates, muni, equity):
+        trace.append(taxable_income(rates, muni, equity))
+        return calc(rates, muni, equity)
+    return traced
+
+
+def calc_one(rates, muni, equity):
+    """scenario_one.investment_calc. rates is (muni_roi, equity_roi, muni_int, equity_div)."""
+    muni_roi, equity_roi, muni_int, equity_div = rates
+    muni_appreciated = round(muni * (1+muni_roi),2)
+    equity_appreciated = round(equity * (1+equity_roi),2)
+    pretax_interest = round(muni*muni_int,2)
+    pretax_dividends = round(equity*equity_div,2)
+    upper, muni_rate, eq_rate = STATE_SCHEDULE[bracket_index(STATE_SCHEDULE, pretax_dividends+pretax_interest)]
+    muni_int_earned = round(pretax_interest*(1-muni_rate/100),2)
+    equity_div_earned = round(pretax_dividends*(1-eq_rate/100),2)
+    return (muni_appreciated, muni_int_earned, equity_appreciated, equity_div_earned)
+
+
+def calc_two(rates, muni, equity):
+    """scenario_two.investment_calc. Raises ZeroDivisionError when there is no income, like the original."""
+    muni_roi, equity_roi, muni_int, equity_div = rates
+    muni_appreciated = round(muni * (1+muni_roi),2)
+    equity_appreciated = round(equity * (1+equity_roi),2)
+    pretax_interest = round(muni*muni_int,2)
+    pretax_dividends = round(equity*equity_div,2)
+    muni_percent = pretax_interest/(pretax_interest+pretax_dividends)
+    upper, deduction, rate = CORP_SCHEDULE[bracket_index(CORP_SCHEDULE, pretax_dividends+pretax_interest)]
+    if deduction is None:
+        muni_int_earned = round(pretax_interest*(1-rate/100),2)
+        equity_div_earned = round(pretax_dividends*(1-rate/100),2)
+    else:
+        muni_int_earned = round((pretax_interest-(deduction*muni_percent))*(1-rate/100),2)
+        equity_div_earned = round((pretax_dividends-(deduction*(1-muni_percent)))*(1-rate/100),2)
+    return (muni_appreciated, muni_int_earned, equity_appreciated, equity_div_earned)
+
+
+CALCS = {'scenario1': calc_one, 'scenario2': calc_two}
+
+DEFAULTS = {
+    'scenario1': {'initial_amount': 1000000, 'muni_roi': 1/100, 'equity_roi': 5/100, 'muni_int': 3/100, 'equity_div': 3/100, 'proportion': 50},
+    'scenario2': {'initial_amount': 950000, 'reserve_fund': 190000, 'muni_roi': 1/100, 'equity_roi': 5/100, 'muni_int': 3/100, 'equity_div': 3/100, 'proportion': 50},
+}
+
+
+#Smallest premium above the reserve fund for scenario2: with less, the year
+#one interest and dividends can round to nothing and calc_two divides by zero.
+MIN_INVESTED = 1000
+
+
+def check_params(kind, params):
+    """
+    Raises ValueError if the arguments (missing ones take the defaults) are
+    outside the ranges the engine handles: returns must be positive and
+    scenario2 needs muni interest, or goal_seek's cost basis lists come up
+    short (IndexError); a scenario2 premium at or just above the reserve
+    fund divides by zero. Passing is not a guarantee, some extreme
+    combinations still fail in the original arithmetic, so batch callers
+    also catch errors per client.
+    """
+    p = dict(DEFAULTS[kind])
+    p.update(params)
+    for name, value in p.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError("%s must be a finite number." % name)
+    if p['initial_amount'] < 0:
+        raise ValueError("initial_amount must not be negative.")
+    if not 0 <= p['proportion'] <= 100:
+        raise ValueError("proportion must be from 0 to 100.")
+    for name in ('muni_roi', 'equity_roi'):
+        if not 0 < p[name] <= 1:
+            raise ValueError("%s must be above 0 and at most 1." % name)
+    for name in ('muni_int', 'equity_div'):
+        if not 0 <= p[name] <= 1:
+            raise ValueError("%s must be from 0 to 1." % name)
+    if kind == 'scenario2':
+        if p['muni_int'] == 0:
+            raise ValueError("muni_int must be above 0 for scenario2.")
+        if p['reserve_fund'] < 0:
+            raise ValueError("reserve_fund must not be negative.")
+        if p['initial_amount'] - p['reserve_fund'] < MIN_INVESTED:
+            raise ValueError("initial_amount must be at least %d above reserve_fund." % MIN_INVESTED)
+
+
+def rates_of(params):
+    return (params['muni_roi'], params['equity_roi'], params['muni_int'], params['equity_div'])
+
+
+def first10(kind, params, years_inv=10, trace=None):
+    """
+    total_returns() for either scenario. params are the constructor arguments
+    (missing ones take the class defaults). Returns a dict of column lists,
+    'Starting Year' first, like the total_df DataFrame.
+
+    If trace is a list, the taxable income of every year is appended to it.
+    """
+    p = dict(DEFAULTS[kind])
+    p.update(params)
+    calc = CALCS[kind]
+    if trace is not None:
+        calc = _traced(calc, trace)
+    rates = rates_of(p)
+    proportion = p['proportion']
+    reserve = []
+    if kind == 'scenario1':
+        net_init_amount = round(p['initial_amount'] * (1 - (39.6/100 + 5.75/100 + 3.8/100)),2)
+        muni_yr1 = muni_amt = round(net_init_amount*(proportion/100),2)
+        eq_yr1 = equity_amt = round(net_init_amount*(1-proportion/100),2)
+    else:
+        muni_yr1 = round((p['initial_amount']-p['reserve_fund'])*(proportion/100),2)
+        eq_yr1 = round((p['initial_amount']-p['reserve_fund'])*(1-proportion/100),2)
+        muni_amt = round(p['initial_amount']*(proportion/100),2)
+        equity_amt = round(p['initial_amount']*(1-proportion/100),2)
+    muni_bases = []
+    muni_ending = []
+    muni_cap_appr = []
+    muni_interest = []
+    equity_bases = []
+    equity_ending = []
+    equity_cap_appr = []
+    equity_div = []
+    for start_year in range(0, years_inv):
+        if start_year == 0:
+            if kind == 'scenario2':
+                reserve.append(round(p['reserve_fund']*1.01,2))
+            ending_muni, interest, ending_equity, dividends = calc(rates, muni_yr1, eq_yr1)
+            muni_bases.append(muni_yr1)
+            equity_bases.append(eq_yr1)
+        else:
+            if kind == 'scenario2':
+                reserve.append(round(reserve[-1]*1.01,2))
+            ending_muni, interest, ending_equity, dividends = calc(rates, muni_ending[start_year-1]+muni_interest[start_year-1]+muni_amt, equity_ending[start_year-1]+equity_div[start_year-1]+equity_amt)
+            if kind == 'scenario1':
+                muni_bases.append(muni_amt*(start_year+1) + sum(muni_interest))
+                equity_bases.append(equity_amt*(start_year+1) + sum(equity_div))
+            else:
+                muni_bases.append(muni_yr1 + muni_amt*(start_year) + sum(muni_interest))
+                equity_bases.append(eq_yr1 + equity_amt*(start_year) + sum(equity_div))
+        muni_ending.append(ending_muni)
+        muni_cap_appr.append(ending_muni - muni_bases[start_year])
+        muni_interest.append(interest)
+        equity_ending.append(ending_equity)
+        equity_cap_appr.append(ending_equity - equity_bases[start_year])
+        equity_div.append(dividends)
+    columns = {'Starting Year': [float(y) for y in range(years_inv)]}
+    if kind == 'scenario2':
+        columns['reserve'] = reserve
+    columns.update([('muni_cost', muni_bases), ('muni_end_amt', muni_ending), ('muni_capgain', muni_cap_appr),
+                    ('net_int', muni_interest), ('equity_cost', equity_bases), ('equity_end_amt', equity_ending),
+                    ('equity_cap_gain', equity_cap_appr), ('net_div', equity_div)])
+    return columns
+
+
+def start_state(first10_columns):
+    """
+    The portfolio at the start of the distribution period, from the last
+    row of first10 (goal_seek reads row 9, which is the last row for the
+    default 10 year horizon).
+    """
+    c = first10_columns
+    return (c['net_int'][-1], c['net_div'][-1], c['muni_end_amt'][-1], c['equity_end_amt'][-1], c['muni_cost'][-1], c['equity_cost'][-1])
+
+
+def initial_guess(kind, start, years_dist=10):
+    """The starting distribution distributions() uses when none is given."""
+    net_int, net_div, muni_end, eq_end, muni_cost, eq_cost = start
+    divisor = years_dist - 2 if kind == 'scenario1' else years_dist
+    return (eq_end+muni_end+net_int+net_div)/(divisor)
+
+
+def simulate(kind, rates, start, distribution, years_dist=10, trace=None):
+    """
+    One pass of the goal_seek loop at a fixed distribution.
+
+    Returns a dict with the raw goal_seek lists (temp_muni_start, ...,
+    dists, dist_nondiv, tax_list) and the residual goal_seek drives to zero,
+    distribution - final muni - final interest. trace works as in first10
+    and is returned under 'trace'.
+    """
+    calc = CALCS[kind]
+    if trace is not None:
+        calc = _traced(calc, trace)
+    capgain_adjuster = CAPGAIN_ADJUSTER
+    net_int, net_div, muni_end, eq_end, muni_cost, eq_cost = start
+    temp_muni_end = []
+    temp_interest = [net_int]
+    temp_eq_end = []
+    temp_div = [net_div]
+    temp_muni_start = [muni_end]
+    temp_eq_start = [eq_end]
+    temp_muni_bases = [muni_cost]
+    temp_eq_bases = [eq_cost]
+    dists = []
+    tax_list = []
+    dist_nondiv = []
+    for dist_year in range(0, years_dist):
+        div_int_year_start = temp_interest[dist_year]+temp_div[dist_year]
+        nondivint_amount = distribution - div_int_year_start
+        eq_after_dist = 0
+        remain_dist_needed = 0
+        muni_after = temp_muni_start[-1]
+        dists.append(distribution)
+        dist_nondiv.append(nondivint_amount)
+        taxes = 0
+        eq_start = temp_eq_start[dist_year]
+
+        #Exhaust equity first
+        if eq_start>0:
+            eq_gains = eq_start-temp_eq_bases[dist_year]
+            if eq_gains >= nondivint_amount/capgain_adjuster:
+                eq_after_dist = eq_start-nondivint_amount/capgain_adjuster
+                temp_eq_bases.append(temp_eq_bases[dist_year])
+                temp_muni_bases.append(temp_muni_bases[-1])
+                taxes+=nondivint_amount/capgain_adjuster-nondivint_amount
+            elif eq_gains > 0 and eq_gains < nondivint_amount/capgain_adjuster:
+                dist_from_gains = eq_gains
+                net_dist_from_gains = dist_from_gains*capgain_adjuster
+                taxes+=dist_from_gains-net_dist_from_gains
+                remain_dist_needed = nondivint_amount - net_dist_from_gains
+                if eq_start-dist_from_gains >= remain_dist_needed:
+                    eq_after_dist = eq_start-dist_from_gains - remain_dist_needed
+                    remain_dist_needed = 0
+                    temp_muni_bases.append(temp_muni_bases[-1])
+                else:
+                    eq_after_dist = 0
+                    remain_dist_needed = abs(eq_start-dist_from_gains - remain_dist_needed)
+                temp_eq_bases.append(eq_after_dist)
+            elif eq_gains == 0 and eq_start >= nondivint_amount:
+                eq_after_dist = eq_start-nondivint_amount
+                temp_eq_bases.append(eq_after_dist)
+                temp_muni_bases.append(temp_muni_bases[-1])
+            elif eq_gains == 0 and eq_start < nondivint_amount:
+                eq_after_dist = 0
+                remain_dist_needed = nondivint_amount - eq_start
+                temp_eq_bases.append(eq_after_dist)
+
+        #goal_seek writes `remain_dist_needed > 0 & (muni_start > 0)`; & binds first,
+        #so the muni check drops out and only remain_dist_needed > 0 is tested.
+        muni_start = temp_muni_start[dist_year]
+        if remain_dist_needed > 0:
+            muni_gains = muni_start-temp_muni_bases[dist_year]
+            if muni_gains >= remain_dist_needed/capgain_adjuster:
+                muni_after = muni_start - remain_dist_needed/capgain_adjuster
+                temp_muni_bases.append(temp_muni_bases[dist_year])
+                taxes+=remain_dist_needed/capgain_adjuster-remain_dist_needed
+            elif muni_gains < remain_dist_needed/capgain_adjuster:
+                dist_from_gains = muni_gains
+                net_dist_from_gains = dist_from_gains*capgain_adjuster
+                remain_dist_needed = remain_dist_needed-net_dist_from_gains
+                muni_after = muni_start-dist_from_gains-remain_dist_needed
+                temp_muni_bases.append(muni_after)
+                taxes+=dist_from_gains-net_dist_from_gains
+
+        #If equities fully distributed and remain_dist_needed = 0
+        if eq_start == 0 and remain_dist_needed == 0:
+            muni_gains = muni_start-temp_muni_bases[dist_year]
+            if muni_gains >= nondivint_amount/capgain_adjuster:
+                muni_after = muni_start-nondivint_amount/capgain_adjuster
+                temp_muni_bases.append(temp_muni_bases[dist_year])
+                taxes+=nondivint_amount/capgain_adjuster-nondivint_amount
+            elif muni_gains > 0 and muni_gains < nondivint_amount/capgain_adjuster:
+                dist_from_gains = muni_gains
+                net_dist_from_gains = dist_from_gains*capgain_adjuster
+                remain_dist_needed = nondivint_amount - net_dist_from_gains
+                if muni_start-dist_from_gains >= remain_dist_needed:
+                    muni_after = muni_start-dist_from_gains-remain_dist_needed
+                    remain_dist_needed = 0
+                    temp_muni_bases.append(muni_after)
+                else:
+                    muni_after = 0
+                    remain_dist_needed = 0
+                    temp_muni_bases.append(muni_after)
+                taxes+=dist_from_gains-net_dist_from_gains
+            elif muni_gains == 0 and muni_start >= nondivint_amount:
+                muni_after = muni_start-nondivint_amount
+                temp_muni_bases.append(muni_after)
+            elif muni_gains == 0 and muni_start < nondivint_amount:
+                muni_after = 0
+                temp_muni_bases.append(muni_after)
+
+        tax_list.append(taxes)
+
+        try:
+            ending_muni, interest, ending_equity, dividends = calc(rates, muni_after, eq_after_dist)
+        except ZeroDivisionError:
+            ending_muni, interest, ending_equity, dividends = [0,0,0,0]
+        temp_muni_end.append(ending_muni)
+        temp_muni_start.append(ending_muni)
+        temp_interest.append(interest)
+        temp_eq_end.append(ending_equity)
+        temp_eq_start.append(ending_equity)
+        temp_div.append(dividends)
+
+    #The final (11th) distribution at the end of the last year. Like goal_seek,
+    #its tax uses the muni gains of the last loop year (dist_year), not the final year.
+    dists.append(distribution)
+    nondivint_amount = distribution - temp_interest[-1]-temp_div[-1]
+    dist_from_gains = temp_muni_start[dist_year]-temp_muni_bases[dist_year]
+    net_dist_from_gains = dist_from_gains*capgain_adjuster
+    dist_nondiv.append(nondivint_amount)
+    tax_list.append(dist_from_gains-net_dist_from_gains)
+    return {'distribution': distribution,
+            'residual': distribution - temp_muni_start[-1] - temp_interest[-1],
+            'temp_muni_start': temp_muni_start, 'temp_muni_bases': temp_muni_bases,
+            'temp_muni_end': temp_muni_end, 'temp_interest': temp_interest,
+            'temp_eq_start': temp_eq_start, 'temp_eq_bases': temp_eq_bases,
+            'temp_eq_end': temp_eq_end, 'temp_div': temp_div,
+            'dists': dists, 'dist_nondiv': dist_nondiv, 'tax_list': tax_list, 'trace': trace}
+
+
+def solve(kind, rates, start, years_dist=10, distribution=0, tol=0.005, max_iter=200, deadline=None, trace=False):
+    """
+    Finds the level distribution that exhausts the portfolio, i.e. drives
+    simulate()'s residual to within tol (half a cent by default).
+
+    distribution is the starting guess (0 uses the same guess as
+    distributions()). The root is bracketed by stepping out from the guess
+    and then refined by false position (Illinois variant), falling back to
+    bisection. deadline is an optional time.monotonic() value after which
+    the search stops. Returns (distribution, simulation, evaluations,
+    converged); if tol is not reached the best evaluated point is returned,
+    and counts as converged when its residual rounds to zero dollars.
+    With trace, every simulation records its taxable incomes (see
+    simulate), so the returned one carries those of the solved path.
+
+    The original arithmetic raises IndexError or ZeroDivisionError for some
+    distributions well above the root, which goal_seek never reaches. A
+    point that raises is treated as above the root: the step towards it is
+    shrunk instead of the error being passed on.
+    """
+    def run(d):
+        try:
+            return simulate(kind, rates, start, d, years_dist, [] if trace else None)
+        except (ArithmeticError, IndexError):
+            return None
+
+    if distribution == 0:
+        distribution = initial_guess(kind, start, years_dist)
+    sim = run(distribution)
+    evaluations = 1
+    while sim is None and evaluations < max_iter:
+        distribution /= 2
+        sim = run(distribution)
+        evaluations += 1
+    if sim is None:
+        #Nothing below the guess could be simulated either; raise the original error.
+        simulate(kind, rates, start, distribution, years_dist)
+    best = sim
+    if abs(sim['residual']) <= tol:
+        return (distribution, sim, evaluations, True)
+
+    #Bracket: the residual grows with the distribution.
+    step = max(abs(sim['residual']), 1.0)
+    lo = hi = distribution
+    rlo = rhi = sim['residual']
+    while (rlo > 0) == (rhi > 0) and evaluations < max_iter and not _expired(deadline):
+        d = hi + step if rhi <= 0 else lo - step
+        sim = run(d)
+        evaluations += 1
+        if sim is None:
+            step /= 4
+            continue
+        if rhi <= 0:
+            lo, rlo = hi, rhi
+            hi, rhi = d, sim['residual']
+        else:
+            hi, rhi = lo, rlo
+            lo, rlo = d, sim['residual']
+        step *= 2
+        if abs(sim['residual']) < abs(best['residual']):
+            best = sim
+        if abs(sim['residual']) <= tol:
+            return (sim['distribution'], sim, evaluations, True)
+
+    side = 0
+    while evaluations < max_iter and (rlo > 0) != (rhi > 0) and not _expired(deadline):
+        d = hi - rhi*(hi-lo)/(rhi-rlo)
+        if not lo < d < hi or math.isnan(d):
+            d = (lo + hi)/2
+        if d == lo or d == hi:
+            break
+        sim = run(d)
+        evaluations += 1
+        if sim is None:
+            #Above the root; keep rhi so the next point falls back towards lo.
+            hi = d
+            side = 1
+            continue
+        r = sim['residual']
+        if abs(r) < abs(best['residual']):
+            best = sim
+        if abs(r) <= tol:
+            return (d, sim, evaluations, True)
+        if r < 0:
+            lo, rlo = d, r
+            if side == -1:
+                rhi /= 2
+            side = -1
+        else:
+            hi, rhi = d, r
+            if side == 1:
+                rlo /= 2
+            side = 1
+    #Cent rounding makes the residual a step function, so tol is not always
+    #reachable; accept the best point if it passes goal_seek's own test.
+    return (best['distribution'], best, evaluations, round(best['residual'], 0) == 0)
+
+
+def _expired(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def _pad(lists):
+    #DataFrame([lists]).T pads short lists with NaN up to the longest one.
+    n = max(len(l) for l in lists)
+    return [list(l) + [float('nan')]*(n - len(l)) for l in lists]
+
+
+def dist_tables(sim, years_inv=10):
+    """
+    Turns a simulation into the two distributions() tables as column dicts,
+    'Starting Year' first: (dist_df columns, dist_info columns).
+    """
+    n = len(sim['dists'])
+    inv_year = [float(y) for y in range(years_inv, years_inv + n)]
+    padded = _pad([inv_year, sim['temp_muni_start'], sim['temp_muni_bases'], sim['temp_muni_end'], sim['temp_interest'],
+                   sim['temp_eq_start'], sim['temp_eq_bases'], sim['temp_eq_end'], sim['temp_div']])
+    dist_df = dict(zip(('Starting Year',) + DIST_COLUMNS, padded))
+    padded = _pad([inv_year, sim['dists'], sim['dist_nondiv'], sim['tax_list']])
+    dist_info = dict(zip(('Starting Year',) + INFO_COLUMNS[:3], padded))
+    dist_info['after_tax_income'] = [d - c for d, c in zip(dist_info['dists'], dist_info['capgains_paid'])]
+    return dist_df, dist_info
+
+
+def after_tax_compare(info1, info2):
+    """
+    after_tax_compare() on dist_info column dicts: the after tax income of
+    both scenarios per year and the difference (scenario 2 - scenario 1),
+    for the years both have, renumbered one year on (11 to 21).
+    """
+    income2 = dict(zip(info2['Starting Year'], info2['after_tax_income']))
+    years = []
+    income_scen1 = []
+    income_scen2 = []
+    for year, income in zip(info1['Starting Year'], info1['after_tax_income']):
+        if year in income2:
+            years.append(year + 1)
+            income_scen1.append(income)
+            income_scen2.append(income2[year])
+    return {'Starting Year': years,
+            'income_scen1': income_scen1,
+            'income_scen2': income_scen2,
+            'difference_income': [b - a for a, b in zip(income_scen1, income_scen2)]}
+
+
+class scenario_config(object):
+    """
+    Immutable scenario parameters: the constructor arguments of
+    scenario_one/scenario_two with defaults filled in. Safe to share
+    between threads and usable as a dict key.
+    """
+    __slots__ = ('kind', '_params', 'rates')
+
+    def __init__(self, kind, **params):
+        if kind not in DEFAULTS:
+            raise ValueError("Unknown scenario %r." % kind)
+        unknown = set(params) - set(DEFAULTS[kind])
+        if unknown:
+            raise TypeError("Unknown %s parameters: %s." % (kind, ', '.join(sorted(unknown))))
+        p = dict(DEFAULTS[kind])
+        p.update(params)
+        object.__setattr__(self, 'kind', kind)
+        object.__setattr__(self, '_params', tuple(sorted(p.items())))
+        object.__setattr__(self, 'rates', rates_of(p))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("scenario_config is immutable, use replace().")
+
+    def __delattr__(self, name):
+        raise AttributeError("scenario_config is immutable.")
+
+    def __getattr__(self, name):
+        for key, value in object.__getattribute__(self, '_params'):
+            if key == name:
+                return value
+        raise AttributeError(name)
+
+    def params(self):
+        return dict(self._params)
+
+    def replace(self, **params):
+        p = self.params()
+        p.update(params)
+        return scenario_config(self.kind, **p)
+
+    def __reduce__(self):
+        #The default pickling sets the slots one by one, which __setattr__ refuses.
+        return (_make_config, (self.kind, self.params()))
+
+    def __eq__(self, other):
+        return isinstance(other, scenario_config) and (self.kind, self._params) == (other.kind, other._params)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.kind, self._params))
+
+    def __repr__(self):
+        return 'scenario_config(%r, %s)' % (self.kind, ', '.join('%s=%r' % kv for kv in self._params))
+
+
+def _make_config(kind, params):
+    return scenario_config(kind, **params)
+
+
+class solve_result(object):
+    """
+    One solved client. first10, dists and info are dicts of column name ->
+    array('d'), the same columns as total_returns() and distributions().
+    incomes, when the solve was traced, is the array('d') of taxable
+    incomes of every year on the path (the schedule lookups, in order).
+    """
+    __slots__ = ('config', 'distribution', 'residual', 'converged', 'evaluations', 'first10', 'dists', 'info', 'incomes')
+
+    def __init__(self, config, distribution, residual, converged, evaluations, first10, dists, info, incomes=None):
+        self.config = config
+        self.distribution = distribution
+        self.residual = residual
+        self.converged = converged
+        self.evaluations = evaluations
+        self.first10 = first10
+        self.dists = dists
+        self.info = info
+        self.incomes = incomes
+
+    def __repr__(self):
+        return 'solve_result(%r, distribution=%r, converged=%r)' % (self.config, self.distribution, self.converged)
+
+
+def _packed(columns):
+    return dict((col, array('d', values)) for col, values in columns.items())
+
+
+def solve_config(config, years_inv=10, years_dist=10, distribution=0, deadline=None, trace=False):
+    """
+    total_returns() and distributions() for a scenario_config, as a
+    solve_result. Keeps no state between calls, so one config can be solved
+    from many threads at once. With trace the result's incomes are
+    recorded during the solve (see va_brackets).
+    """
+    params = config.params()
+    incomes = [] if trace else None
+    first10_columns = first10(config.kind, params, years_inv, incomes)
+    found, sim, evaluations, converged = solve(config.kind, config.rates, start_state(first10_columns),
+                                               years_dist, distribution, deadline=deadline, trace=trace)
+    dist_df, dist_info = dist_tables(sim, years_inv)
+    if trace:
+        incomes = array('d', incomes + sim['trace'])
+    return solve_result(config, found, sim['residual'], converged, evaluations,
+                        _packed(first10_columns), _packed(dist_df), _packed(dist_info), incomes)
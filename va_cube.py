@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Book level aggregates over batch results.
+
+cube_sink is a va_batch sink that folds every client into running sums and
+counts keyed by (advisor, region, scenario, year) as the batch goes, so the
+per-client rows never have to be kept or concatenated:
+
+    cube = book_cube()
+    attributes = {}
+    sink = va_batch.tee_sink(va_batch.store_sink('book.vastore'), cube_sink(cube, attributes))
+    va_batch.run_batch(va_roster.roster_clients(reader, attributes), sink, engine='fast')
+    cube.save('book.cube.json')
+    cube.rollup(['advisor', 'year'])
+
+Measures per cell are after_tax_income and capgains_paid (from the
+distributions table) and total_assets (equity_end_amt + muni_end_amt of the
+combine_csvs table), each as a sum and a count of client-years. Years are
+numbered like combine_csvs, 1 to years_inv + years_dist + 1, so the
+distribution years line up with after_tax_compare's 11 to 21.
+
+difference_income at book level is the scenario2 sum minus the scenario1
+sum; for a roster with every client run under both scenarios it equals the
+sum of each client's after_tax_compare difference_income.
+"""
+
+import json
+import math
+
+DIMENSIONS = ('advisor', 'region', 'scenario', 'year')
+MEASURES = ('after_tax_income', 'capgains_paid', 'total_assets')
+
+
+class book_cube(object):
+    def __init__(self, dimensions=DIMENSIONS):
+        self.dimensions = tuple(dimensions)
+        #key tuple (one value per dimension) -> [sum, count] per measure, flattened
+        self.cells = {}
+        self.clients = 0
+
+    def add(self, values, measure, amount):
+        """Adds one client-year. values maps dimension -> value; NaN amounts are skipped."""
+        if amount is None or math.isnan(amount):
+            return
+        key = tuple(values.get(d, '') for d in self.dimensions)
+        cell = self.cells.get(key)
+        if cell is None:
+            cell = self.cells[key] = [0.0, 0] * len(MEASURES)
+        i = 2 * MEASURES.index(measure)
+        cell[i] += amount
+        cell[i + 1] += 1
+
+    def rollup(self, by=(), **filters):
+        """
+        Sums over every dimension not in by, keeping cells that match
+        filters (dimension=value). Returns {key tuple of the by values:
+        {measure: sum, measure + '_count': count}}.
+        """
+        by = list(by)
+        for name in by + list(filters):
+            if name not in self.dimensions:
+                raise ValueError("Unknown dimension %s, the cube has %s." % (name, ', '.join(self.dimensions)))
+        positions = [self.dimensions.index(d) for d in by]
+        checks = [(self.dimensions.index(d), v) for d, v in filters.items()]
+        out = {}
+        for key, cell in self.cells.items():
+            if any(key[i] != v for i, v in checks):
+                continue
+            group = tuple(key[i] for i in positions)
+            total = out.get(group)
+            if total is None:
+                total = out[group] = [0.0, 0] * len(MEASURES)
+            for i, value in enumerate(cell):
+                total[i] += value
+        return {group: self._named(total) for group, total in out.items()}
+
+    def _named(self, cell):
+        named = {}
+        for i, measure in enumerate(MEASURES):
+            named[measure] = cell[2 * i]
+            named[measure + '_count'] = cell[2 * i + 1]
+        return named
+
+    def difference_income(self, by=(), **filters):
+        """after_tax_income of scenario2 minus scenario1, per group of by (which cannot include scenario)."""
+        if 'scenario' in by or 'scenario' in filters:
+            raise ValueError("difference_income is taken across scenarios.")
+        two = self.rollup(by, scenario='scenario2', **filters)
+        one = self.rollup(by, scenario='scenario1', **filters)
+        return {group: two.get(group, {}).get('after_tax_income', 0.0) - one.get(group, {}).get('after_tax_income', 0.0)
+                for group in set(two) | set(one)}
+
+    def save(self, path):
+        with open(path, 'w') as fh:
+            json.dump({'dimensions': self.dimensions,
+                       'measures': MEASURES,
+                       'clients': self.clients,
+                       'cells': [list(key) + cell for key, cell in self.cells.items()]}, fh)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fh:
+            data = json.load(fh)
+        if tuple(data['measures']) != MEASURES:
+            raise ValueError("%s was saved with measures %s." % (path, ', '.join(data['measures'])))
+        cube = cls(data['dimensions'])
+        n = len(cube.dimensions)
+        cube.clients = data['clients']
+        for row in data['cells']:
+            cube.cells[tuple(row[:n])] = row[n:]
+        return cube
+
+
+class cube_sink(object):
+    def __init__(self, cube, attributes=None):
+        """
+        Folds result_chunks into cube. attributes maps client_id -> {'advisor':
+        ..., 'region': ...}; an entry is dropped once its client is done.
+        Missing values are ''.
+        """
+        self.cube = cube
+        self.attributes = attributes if attributes is not None else {}
+        #client_id -> first10 columns, until the client's dists chunk arrives
+        self._first10 = {}
+
+    def _values(self, chunk):
+        values = dict(self.attributes.get(chunk.client_id) or {})
+        values['scenario'] = chunk.scenario
+        return values
+
+    def write(self, chunk):
+        cube = self.cube
+        values = self._values(chunk)
+        if chunk.table == 'first10':
+            self._first10[chunk.client_id] = chunk.columns
+        elif chunk.table == 'dists':
+            #combine_csvs: first10 rows then dists rows, NaN as 0, numbered from 1.
+            first10 = self._first10.pop(chunk.client_id, None) or {'equity_end_amt': [], 'muni_end_amt': []}
+            equity = list(first10['equity_end_amt']) + list(chunk.columns['equity_end_amt'])
+            muni = list(first10['muni_end_amt']) + list(chunk.columns['muni_end_amt'])
+            for year, (e, m) in enumerate(zip(equity, muni), 1):
+                values['year'] = year
+                cube.add(values, 'total_assets', (0 if math.isnan(e) else e) + (0 if math.isnan(m) else m))
+        elif chunk.table == 'distributions':
+            columns = chunk.columns
+            for start_year, income, capgains in zip(columns['Starting Year'], columns['after_tax_income'], columns['capgains_paid']):
+                values['year'] = int(start_year) + 1
+                cube.add(values, 'after_tax_income', income)
+                cube.add(values, 'capgains_paid', capgains)
+            cube.clients += 1
+            self.attributes.pop(chunk.client_id, None)
+        elif chunk.table == 'failed':
+            #Nothing of a failed client is counted.
+            self._first10.pop(chunk.client_id, None)
+            self.attributes.pop(chunk.client_id, None)
+
+    def close(self):
+        self._first10 = {}
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Query a saved book cube.')
+    parser.add_argument('cube')
+    parser.add_argument('--by', default = '', help = 'Comma separated dimensions to group by.')
+    parser.add_argument('--where', action = 'append', default = [], metavar = 'DIMENSION=VALUE')
+    parser.add_argument('--difference', action = 'store_true', help = 'Show scenario2 - scenario1 after tax income instead.')
+    args = parser.parse_args()
+
+    cube = book_cube.load(args.cube)
+    by = [d for d in args.by.split(',') if d]
+    filters = {}
+    for item in args.where:
+        name, _, value = item.partition('=')
+        filters[name] = int(value) if name == 'year' else value
+    if args.difference:
+        rows = cube.difference_income(by, **filters)
+        for group in sorted(rows):
+            print(','.join(str(v) for v in group + (rows[group],)))
+    else:
+        rows = cube.rollup(by, **filters)
+        print(','.join(by + [name for m in MEASURES for name in (m, m + '_count')]))
+        for group in sorted(rows):
+            print(','.join(str(v) for v in group + tuple(rows[group][name] for m in MEASURES for name in (m, m + '_count'))))
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Data feed for scenario_viz.html.
+
+Builds one JSON file holding everything the page shows for many clients,
+so it loads with a single request and switches clients without new CSVs.
+Each client is one scenario1/scenario2 pair, solved with the fast engine:
+
+    python va_feed.py --clients clients.json --out scenario_feed.json
+
+clients.json is a list of {"id": ..., "label": ..., "scenario1": {params},
+"scenario2": {params}}; without --clients the feed has the default pair the
+CSV export writes.
+
+Per client and scenario the feed has the stacked total assets series (the
+layers of the scenario*_totalassets.csv files, equity_end_amt then
+muni_end_amt, as the running top of each layer, so layer i spans
+tops[i-1]..tops[i]), plus the after_tax_compare table, the savings headline
+(the sum of difference_income) and the y range of the chart. The book
+headline sums the savings of every client. Amounts are rounded to cents.
+"""
+
+import json
+import math
+
+import va_core
+
+FEED_VERSION = 1
+LAYERS = ('equity_end_amt', 'muni_end_amt')
+
+
+def _cents(values):
+    return [round(v, 2) for v in values]
+
+
+def total_assets_layers(result):
+    """
+    The columns of scenario*_totalassets.csv from a solve_result: first10
+    then dists rows, NaN as 0, like combine_csvs.
+    """
+    layers = []
+    for col in LAYERS:
+        values = list(result.first10[col]) + list(result.dists[col])
+        layers.append([0.0 if math.isnan(v) else v for v in values])
+    return layers
+
+
+def stack_tops(layers):
+    #d3.stack with stackOffsetNone: each layer sits on the running total of the ones before it.
+    tops = []
+    running = [0.0] * len(layers[0])
+    for layer in layers:
+        running = [a + b for a, b in zip(running, layer)]
+        tops.append(_cents(running))
+    return tops
+
+
+def headline(amount):
+    return "Captive Insurance saves $%.2fMM from Taxes" % (amount / 1e6)
+
+
+def client_feed(client_id, params1=None, params2=None, label=None, years_inv=10, years_dist=10):
+    """Solves one client's scenario pair and returns its entry in the feed."""
+    entry = {'id': client_id, 'label': label or str(client_id)}
+    results = []
+    ymax = 0.0
+    for kind, params in (('scenario1', params1), ('scenario2', params2)):
+        result = va_core.solve_config(va_core.scenario_config(kind, **(params or {})), years_inv, years_dist)
+        results.append(result)
+        tops = stack_tops(total_assets_layers(result))
+        ymax = max([ymax] + tops[-1])
+        entry[kind] = {'params': result.config.params(),
+                       'distribution': round(result.distribution, 2),
+                       'converged': result.converged,
+                       'tops': tops}
+    income = va_core.after_tax_compare(results[0].info, results[1].info)
+    savings = sum(income['difference_income'])
+    entry['income'] = {col: _cents(values) for col, values in income.items()}
+    entry['savings'] = round(savings, 2)
+    entry['headline'] = headline(savings)
+    entry['ymax'] = ymax
+    return entry
+
+
+def build_feed(clients, years_inv=10, years_dist=10):
+    """
+    clients is an iterable of dicts with id, and optionally label,
+    scenario1 and scenario2 (the constructor arguments of each scenario).
+    """
+    entries = [client_feed(c['id'], c.get('scenario1'), c.get('scenario2'), c.get('label'), years_inv, years_dist)
+               for c in clients]
+    savings = sum(e['savings'] for e in entries)
+    return {'version': FEED_VERSION,
+            'tax_schedule_version': va_core.TAX_SCHEDULE_VERSION,
+            'layers': list(LAYERS),
+            'years': list(range(1, years_inv + years_dist + 2)),
+            'book': {'clients': len(entries), 'savings': round(savings, 2), 'headline': headline(savings)},
+            'clients': entries}
+
+
+def write_feed(path, feed):
+    with open(path, 'w') as fh:
+        json.dump(feed, fh, separators=(',', ':'))
+    return path
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Write the multi-client feed for scenario_viz.html.')
+    parser.add_argument('--clients', help = 'JSON list of {"id", "label", "scenario1", "scenario2"}.')
+    parser.add_argument('--out', default = 'scenario_feed.json')
+    parser.add_argument('--years-inv', type = int, default = 10)
+    parser.add_argument('--years-dist', type = int, default = 10)
+    args = parser.parse_args()
+
+    if args.clients:
+        with open(args.clients) as fh:
+            clients = json.load(fh)
+    else:
+        clients = [{'id': 'client1', 'label': 'Default client'}]
+    feed = build_feed(clients, args.years_inv, args.years_dist)
+    write_feed(args.out, feed)
+    print("%d clients, %s, written to %s" % (feed['book']['clients'], feed['book']['headline'], args.out))
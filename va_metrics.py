@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Solver and stage instrumentation.
+
+Each scenario instance carries a solve_metrics object (client.metrics) that
+goal_seek and distributions fill in: goal_seek passes, simulations evaluated,
+final residual, non-convergence events and wall time per stage. Progress
+goes to the 'va_scenariocalculator' logger instead of stdout, and an
+optional hook gets every event as it happens.
+"""
+
+from contextlib import contextmanager
+import logging
+import time
+
+logger = logging.getLogger('va_scenariocalculator')
+
+
+class solve_metrics(object):
+    def __init__(self, hook=None):
+        """
+        hook, if given, is called as hook(event, metrics, fields) for the events
+        'goal_seek', 'non_convergence', 'solved' and 'stage'.
+        """
+        self.hook = hook
+        self.stage_times = {}
+        self.start_solve()
+
+    def start_solve(self):
+        """Clears the solver counters, called at the start of each distributions() run."""
+        #goal_seek passes (one per step size of the cascade)
+        self.iterations = 0
+        #full distribution period simulations evaluated
+        self.simulations = 0
+        self.distribution = None
+        self.residual = None
+        self.converged = None
+        self.non_convergence = []
+
+    def emit(self, event, **fields):
+        if self.hook is not None:
+            self.hook(event, self, fields)
+
+    def goal_seek_done(self, rounder, increment, loops, distribution, ending, converged):
+        self.iterations += 1
+        self.simulations += loops
+        fields = {'rounder': rounder, 'increment': increment, 'loops': loops,
+                  'distribution': distribution, 'ending': ending}
+        logger.debug("goal_seek rounder=%s increment=%s loops=%d distribution=%.2f ending=%.2f",
+                     rounder, increment, loops, distribution, ending)
+        self.emit('goal_seek', **fields)
+        if not converged:
+            self.non_convergence.append(fields)
+            logger.warning("goal_seek did not converge after %d loops (distribution %.2f, ending %.2f). "
+                           "Try re-running with a different starting distribution.", loops, distribution, ending)
+            self.emit('non_convergence', **fields)
+
+    def solved(self, distribution, residual):
+        self.distribution = distribution
+        self.residual = residual
+        self.converged = round(residual, 0) == 0
+        logger.info("Solve finished: distribution %.2f per year, residual %.4f, %d simulations.",
+                    distribution, residual, self.simulations)
+        self.emit('solved', distribution=distribution, residual=residual)
+
+    def add_time(self, name, seconds):
+        self.stage_times[name] = self.stage_times.get(name, 0) + seconds
+        self.emit('stage', stage=name, seconds=seconds)
+
+    def as_dict(self):
+        return {'iterations': self.iterations,
+                'simulations': self.simulations,
+                'distribution': self.distribution,
+                'residual': self.residual,
+                'converged': self.converged,
+                'non_convergence': len(self.non_convergence),
+                'stage_times': dict(self.stage_times)}
+
+
+@contextmanager
+def stage(metrics, name):
+    """Times the enclosed block and adds it to metrics.stage_times[name]. metrics may be None."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.add_time(name, time.perf_counter() - start)
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Dependency graph runner for the report run.
+
+The report is a small graph of stages: each client's total_returns and
+distributions, combine_csvs, its CSV writes, and after_tax_compare once both
+clients are solved. pipeline runs every stage as soon as its dependencies
+are done: compute stages in a process pool, so the two clients solve at the
+same time, and write stages on background threads, so client1's CSVs are
+written while client2 is still solving. The run takes as long as the slowest
+branch rather than the sum of all of them.
+
+With a cache directory, each stage's output is pickled under a key hashed
+from the stage's function, its arguments and the keys of its dependencies
+(plus the tax schedule version). The function counts by its code: the source
+of the module it is defined in and of any modules the stage names as code it
+calls, so editing va_core or va_scenariocalculator invalidates the stages
+that use them. A rerun loads every stage whose key has not
+changed, so changing client2's parameters only recomputes client2's branch,
+the compare and the writes after them. A write stage is also rerun if one of
+the files it wrote is gone.
+
+    python va_pipeline.py --dir . --cache .va_cache --set2 initial_amount=1000000
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import hashlib
+import importlib
+import inspect
+import json
+import marshal
+import os
+import pickle
+import time
+
+import va_core
+
+KINDS = ('process', 'thread')
+
+#Modules the report stages call into; their source is part of every report stage's key.
+REPORT_MODULES = ('va_core', 'va_batch', 'va_scenariocalculator')
+
+_sources = {}
+
+
+def _module_source(name):
+    if name not in _sources:
+        try:
+            _sources[name] = inspect.getsource(importlib.import_module(name))
+        except (ImportError, OSError, TypeError):
+            _sources[name] = ''
+    return _sources[name]
+
+
+def code_hash(fn, modules=()):
+    """
+    Hash of fn's code: the source of its module and of each named module,
+    or fn's bytecode and constants when there is no source to read.
+    """
+    h = hashlib.sha256()
+    for name in (fn.__module__,) + tuple(modules):
+        source = _module_source(name)
+        if not source and name == fn.__module__:
+            code = fn.__code__
+            source = repr((code.co_code, marshal.dumps(code.co_consts), code.co_names))
+        h.update(name.encode('utf-8') + b'\0' + source.encode('utf-8') + b'\0')
+    return h.hexdigest()
+
+
+class stage(object):
+    def __init__(self, name, fn, deps=(), args=(), kind='process', modules=()):
+        """
+        fn(*args, *dependency outputs) computes the stage. fn must be a
+        module level function and args plain data (they are sent to a worker
+        process and hashed for the cache). kind 'thread' runs fn on a
+        background thread in this process instead, for file writes; a thread
+        stage returns the list of paths it wrote. modules names the modules
+        fn calls into, whose source goes into the cache key with fn's own.
+        """
+        if kind not in KINDS:
+            raise ValueError("Unknown stage kind %r." % kind)
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.args = tuple(args)
+        self.kind = kind
+        self.code = code_hash(fn, modules)
+
+
+class pipeline(object):
+    def __init__(self, cache_dir=None, version=va_core.TAX_SCHEDULE_VERSION):
+        self.stages = {}
+        self.cache_dir = cache_dir
+        self.version = version
+
+    def add(self, name, fn, deps=(), args=(), kind='process', modules=()):
+        """Adds a stage. Its dependencies must be added first, so the graph cannot have cycles."""
+        if name in self.stages:
+            raise ValueError("Stage %s is already in the pipeline." % name)
+        missing = [d for d in deps if d not in self.stages]
+        if missing:
+            raise ValueError("Stage %s depends on unknown stages %s." % (name, ', '.join(missing)))
+        self.stages[name] = stage(name, fn, deps, args, kind, modules)
+        return self.stages[name]
+
+    def key(self, st, dep_keys):
+        text = json.dumps([self.version, st.fn.__module__, st.fn.__qualname__, st.code, st.args, dep_keys], sort_keys=True, default=repr)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _cache_path(self, name, key):
+        return os.path.join(self.cache_dir, '%s-%s.pkl' % (name, key[:20]))
+
+    def _load(self, st, key):
+        if self.cache_dir is None:
+            return False, None
+        try:
+            with open(self._cache_path(st.name, key), 'rb') as fh:
+                value = pickle.load(fh)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False, None
+        if st.kind == 'thread' and not all(os.path.exists(p) for p in value):
+            return False, None
+        return True, value
+
+    def _save(self, name, key, value):
+        path = self._cache_path(name, key)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as fh:
+            pickle.dump(value, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def run(self, workers=None, threads=2, metrics=None):
+        """
+        Runs the graph and returns (outputs, stats): outputs maps stage name
+        to its output, stats maps it to {'cached': bool, 'seconds': float}.
+        The first stage to raise stops the run; stages already running finish.
+        Stages run in other processes, so their timings are taken here: if
+        metrics (a va_metrics.solve_metrics) is given, the wall time of each
+        stage that ran is added to it under the stage name.
+        """
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        outputs = {}
+        keys = {}
+        stats = {}
+        pending = list(self.stages)
+        running = {}
+        saves = []
+        with ProcessPoolExecutor(max_workers=workers) as procs, ThreadPoolExecutor(max_workers=threads) as io:
+            while pending or running:
+                #Start everything that is ready; a cache hit can make more stages ready.
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for name in list(pending):
+                        st = self.stages[name]
+                        if not all(d in outputs for d in st.deps):
+                            continue
+                        pending.remove(name)
+                        progressed = True
+                        keys[name] = self.key(st, [keys[d] for d in st.deps])
+                        hit, value = self._load(st, keys[name])
+                        if hit:
+                            outputs[name] = value
+                            stats[name] = {'cached': True, 'seconds': 0.0}
+                            continue
+                        pool = io if st.kind == 'thread' else procs
+                        future = pool.submit(st.fn, *(st.args + tuple(outputs[d] for d in st.deps)))
+                        running[future] = (name, time.perf_counter())
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, start = running.pop(future)
+                    outputs[name] = future.result()
+                    stats[name] = {'cached': False, 'seconds': time.perf_counter() - start}
+                    if metrics is not None:
+                        metrics.add_time(name, stats[name]['seconds'])
+                    if self.cache_dir is not None:
+                        saves.append(io.submit(self._save, name, keys[name], outputs[name]))
+            for future in saves:
+                future.result()
+        return outputs, stats
+
+
+def solve_scenario(kind, params, years_inv=10, years_dist=10):
+    """total_returns and distributions for one client: (first10, dist_df, dist_info)."""
+    from va_batch import make_client
+    client = make_client(kind, **params)
+    first10 = client.total_returns(years_inv)
+    dist_df, dist_info = client.distributions(years_dist)
+    return first10, dist_df, dist_info
+
+
+def combine_solved(solved):
+    #Timed by pipeline.run, like every stage.
+    from va_scenariocalculator import combine_csvs
+    first10, dist_df, dist_info = solved
+    return combine_csvs(first10, dist_df)
+
+
+def compare_solved(solved1, solved2):
+    from va_scenariocalculator import after_tax_compare
+    return after_tax_compare(solved1[2], solved2[2])
+
+
+def write_client(n, directory, solved, df_returns):
+    from va_scenariocalculator import write_client_csvs
+    first10, dist_df, dist_info = solved
+    return write_client_csvs(n, first10, dist_df, dist_info, df_returns, directory)
+
+
+def write_income(directory, after_tax):
+    from va_scenariocalculator import write_income_csv
+    return write_income_csv(after_tax, directory)
+
+
+def report_pipeline(params1=None, params2=None, directory='.', cache_dir=None):
+    """The graph of the va_scenariocalculator report run: the same CSVs as export_csvs."""
+    p = pipeline(cache_dir)
+    for n, kind, params in ((1, 'scenario1', params1), (2, 'scenario2', params2)):
+        p.add('solve%d' % n, solve_scenario, args=(kind, dict(params or {})), modules=REPORT_MODULES)
+        p.add('combine%d' % n, combine_solved, deps=['solve%d' % n], modules=REPORT_MODULES)
+        p.add('write%d' % n, write_client, deps=['solve%d' % n, 'combine%d' % n], args=(n, directory), kind='thread',
+              modules=REPORT_MODULES)
+    p.add('compare', compare_solved, deps=['solve1', 'solve2'], modules=REPORT_MODULES)
+    p.add('write_income', write_income, deps=['compare'], args=(directory,), kind='thread', modules=REPORT_MODULES)
+    return p
+
+
+if __name__ == "__main__":
+    import argparse
+    from va_cli import parse_assignments
+    parser = argparse.ArgumentParser(description = 'Run the report as a concurrent stage graph.')
+    parser.add_argument('--dir', default = '.', help = 'Directory for the CSVs.')
+    parser.add_argument('--cache', help = 'Cache directory; stages whose inputs are unchanged are loaded from it.')
+    parser.add_argument('--workers', type = int, help = 'Processes for compute stages.')
+    parser.add_argument('--set1', action = 'append', metavar = 'NAME=VALUE', help = 'Scenario one argument.')
+    parser.add_argument('--set2', action = 'append', metavar = 'NAME=VALUE', help = 'Scenario two argument.')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    report = report_pipeline(parse_assignments(args.set1, 'scenario1'), parse_assignments(args.set2, 'scenario2'),
+                             args.dir, args.cache)
+    outputs, stats = report.run(args.workers)
+    for name, s in stats.items():
+        print("%-14s %s" % (name, 'cached' if s['cached'] else '%.3fs' % s['seconds']))
+    print("total %.3fs" % (time.perf_counter() - start))
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Target-income planning: the premium or number of contribution years a
+client needs for a given after tax income.
+
+The inverse of total_returns() + distributions(). For a target yearly after
+tax income it finds, under either scenario, the initial_amount
+(solve_amount) or the years_inv (solve_years) that reaches it:
+
+    python va_planner.py amount --scenario scenario2 --target 800000 --reserve-ratio 0.2
+    python va_planner.py years --scenario scenario1 --target 800000
+
+The yearly income of a plan is the lowest after_tax_income of its
+distribution years by default (measure='min'), i.e. the target is met every
+year; 'mean' and 'first' are the alternatives. Income rises with both
+inputs, so the outer search brackets the answer and then narrows it. Each
+round solves a batch of candidates with va_core (in parallel if an
+executor is given), each warm-started from the nearest solved candidate's
+distribution scaled by the ratio of the values. The answer comes back with its
+cost: outer rounds, inner solves, simulations and seconds.
+"""
+
+import math
+import time
+
+import va_core
+
+MEASURES = ('min', 'mean', 'first')
+
+
+class plan_result(object):
+    """
+    value is the initial_amount or years_inv found (None if the target is
+    out of reach), income the yearly income it gives and result its
+    va_core.solve_result.
+    """
+    __slots__ = ('variable', 'target', 'measure', 'value', 'income', 'result', 'converged',
+                 'rounds', 'inner_solves', 'evaluations', 'seconds')
+
+    def __init__(self, variable, target, measure, value, income, result, converged, rounds, inner_solves, evaluations, seconds):
+        self.variable = variable
+        self.target = target
+        self.measure = measure
+        self.value = value
+        self.income = income
+        self.result = result
+        self.converged = converged
+        self.rounds = rounds
+        self.inner_solves = inner_solves
+        self.evaluations = evaluations
+        self.seconds = seconds
+
+    def cost(self):
+        return {'rounds': self.rounds, 'inner_solves': self.inner_solves,
+                'evaluations': self.evaluations, 'seconds': self.seconds}
+
+    def __repr__(self):
+        return 'plan_result(%s=%r, income=%r, converged=%r)' % (self.variable, self.value, self.income, self.converged)
+
+
+def yearly_income(info, measure='min'):
+    """The yearly after tax income of a dist_info column dict."""
+    values = [v for v in info['after_tax_income'] if not math.isnan(v)]
+    if measure == 'min':
+        return min(values)
+    if measure == 'mean':
+        return sum(values)/len(values)
+    if measure == 'first':
+        return values[0]
+    raise ValueError("measure must be one of %s." % ', '.join(MEASURES))
+
+
+def inner_solve(kind, params, years_inv, years_dist, guess, measure):
+    """
+    One candidate: (yearly income, distribution, simulations, converged).
+    Module level and small in and out, so it can run in a process pool.
+    """
+    result = va_core.solve_config(va_core.scenario_config(kind, **params), years_inv, years_dist, guess)
+    return (yearly_income(result.info, measure), result.distribution, result.evaluations, result.converged)
+
+
+class _search(object):
+    #Shared bookkeeping of the outer search: solved candidates and their cost.
+    def __init__(self, kind, measure, executor, candidate):
+        #candidate(value) -> (params, years_inv, years_dist) of that candidate
+        self.kind = kind
+        self.measure = measure
+        self.executor = executor
+        self.candidate = candidate
+        #value -> (income, distribution, evaluations, converged)
+        self.solved = {}
+        self.rounds = 0
+        self.evaluations = 0
+        self.start = time.perf_counter()
+
+    def _guess(self, value):
+        #Warm start: the distribution of the nearest solved candidate, scaled.
+        if not self.solved:
+            return 0
+        nearest = min(self.solved, key=lambda v: abs(v - value))
+        income, distribution, evaluations, converged = self.solved[nearest]
+        return distribution * value/nearest if nearest else 0
+
+    def evaluate(self, values):
+        """Solves the candidate values not solved yet, as one batch; returns the incomes of all of them in order."""
+        new = [v for v in values if v not in self.solved]
+        if new:
+            self.rounds += 1
+            jobs = [(self.kind,) + self.candidate(v) + (self._guess(v), self.measure) for v in new]
+            if self.executor is None:
+                outputs = [inner_solve(*job) for job in jobs]
+            else:
+                outputs = list(self.executor.map(inner_solve, *zip(*jobs)))
+            for value, output in zip(new, outputs):
+                self.solved[value] = output
+                self.evaluations += output[2]
+        return [self.income(v) for v in values]
+
+    def income(self, value):
+        return self.solved[value][0]
+
+    def finish(self, variable, target, value, converged):
+        result = None
+        income = None
+        if value is not None:
+            params, years_inv, years_dist = self.candidate(value)
+            distribution = self.solved[value][1]
+            #Same inputs and a start on the root: one simulation.
+            result = va_core.solve_config(va_core.scenario_config(self.kind, **params), years_inv, years_dist, distribution)
+            income = yearly_income(result.info, self.measure)
+            self.evaluations += result.evaluations
+            converged = converged and result.converged
+        return plan_result(variable, target, self.measure, value, income, result, converged, self.rounds,
+                           len(self.solved) + (value is not None), self.evaluations, time.perf_counter() - self.start)
+
+
+def solve_amount(kind, target, params=None, measure='min', years_inv=10, years_dist=10, reserve_ratio=None,
+                 tol=1.0, batch=3, max_rounds=40, executor=None):
+    """
+    The initial_amount that gives target yearly after tax income, to within
+    tol dollars of income. params are the other constructor arguments. For
+    scenario2 the reserve fund stays at params['reserve_fund'] (default
+    190000) unless reserve_ratio is given, in which case it is that share of
+    the amount. batch is the number of candidates solved per round.
+
+    With a fixed reserve fund the amount cannot go below it. If the smallest
+    amount above the reserve fund already gives more than target, that
+    amount is the value, with converged False.
+    """
+    reserve = dict(va_core.DEFAULTS[kind], **(params or {})).get('reserve_fund', 0)
+    floor = 0.0 if kind == 'scenario1' or reserve_ratio is not None else reserve
+
+    def candidate(amount):
+        p = dict(params or {})
+        p['initial_amount'] = amount
+        if kind == 'scenario2' and reserve_ratio is not None:
+            p['reserve_fund'] = round(amount*reserve_ratio, 2)
+        return (p, years_inv, years_dist)
+
+    search = _search(kind, measure, executor, candidate)
+    if target <= 0:
+        raise ValueError("target must be a positive income.")
+    batch = max(batch, 2)
+
+    #Income is close to proportional to the amount: predict from one solve, then bracket around it.
+    base = float(dict(va_core.DEFAULTS[kind], **(params or {}))['initial_amount'])
+    base = max(base, floor*2, 1.0)
+    search.evaluate([base])
+    guess = max(base*target/search.income(base), floor*1.01) if search.income(base) > 0 else base*2
+    spread = 0.05
+    lo = hi = None
+    #Bounded by steps, not rounds: candidates clamped to the floor are already solved and add no round.
+    for step in range(max_rounds):
+        candidates = [max(guess*(1 + spread)**(k - (batch - 1)/2), floor*1.0001) for k in range(batch)]
+        search.evaluate(candidates)
+        below = [v for v in search.solved if search.income(v) < target]
+        above = [v for v in search.solved if search.income(v) >= target]
+        if below and above:
+            lo, hi = max(below), min(above)
+            if lo < hi:
+                break
+        if above and not below and min(above) <= floor*1.0001:
+            return search.finish('initial_amount', target, min(above), False)
+        spread *= 2
+        guess = guess*(1 + spread) if not above else guess/(1 + spread)
+    if lo is None:
+        return search.finish('initial_amount', target, None, False)
+
+    #Narrow the bracket: the false position point and evenly spaced points, in one batch per round.
+    while search.rounds < max_rounds:
+        flo = search.income(lo) - target
+        fhi = search.income(hi) - target
+        if fhi <= tol or hi - lo <= 0.01:
+            break
+        point = lo - flo*(hi - lo)/(fhi - flo)
+        candidates = [round(point, 2)] + [round(lo + (hi - lo)*k/batch, 2) for k in range(1, batch)]
+        search.evaluate([c for c in candidates if lo < c < hi])
+        below = [v for v in search.solved if lo <= v < hi and search.income(v) < target]
+        above = [v for v in search.solved if lo < v <= hi and search.income(v) >= target]
+        new_lo = max(below) if below else lo
+        new_hi = min(above) if above else hi
+        if (new_lo, new_hi) == (lo, hi):
+            break
+        lo, hi = new_lo, new_hi
+    return search.finish('initial_amount', target, hi, search.income(hi) - target <= tol)
+
+
+def solve_years(kind, target, params=None, measure='min', years_dist=10, max_years=60, batch=4, executor=None):
+    """
+    The fewest contribution years (years_inv) that give at least target
+    yearly after tax income with the given params. value is None if even
+    max_years is not enough.
+    """
+    def candidate(years):
+        return (dict(params or {}), years, years_dist)
+
+    search = _search(kind, measure, executor, candidate)
+    if target <= 0:
+        raise ValueError("target must be a positive income.")
+    batch = max(batch, 2)
+
+    #Double until one meets the target, a batch of years at a time.
+    lo, hi = 0, None
+    start = 1
+    while hi is None and start <= max_years and search.rounds < max_years:
+        candidates = []
+        years = start
+        while len(candidates) < batch and years <= max_years:
+            candidates.append(years)
+            years *= 2
+        search.evaluate(candidates)
+        for years in candidates:
+            if search.income(years) >= target:
+                hi = years
+                break
+            lo = years
+        start = candidates[-1]*2
+    if hi is None:
+        if max_years not in search.solved:
+            search.evaluate([max_years])
+        if search.income(max_years) >= target:
+            hi = max_years
+        else:
+            return search.finish('years_inv', target, None, False)
+
+    #Split (lo, hi) into batch + 1 parts per round until they are neighbours.
+    while hi - lo > 1:
+        step = max((hi - lo)//(batch + 1), 1)
+        candidates = list(range(lo + step, hi, step))[:batch]
+        search.evaluate(candidates)
+        for years in candidates:
+            if search.income(years) >= target:
+                hi = years
+                break
+            lo = years
+    return search.finish('years_inv', target, hi, True)
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from va_cli import parse_assignments
+    parser = argparse.ArgumentParser(description = 'Find the premium or contribution years for a target after tax income.')
+    sub = parser.add_subparsers(dest = 'command')
+    for name, help_text in (('amount', 'Solve for initial_amount.'), ('years', 'Solve for years_inv.')):
+        p = sub.add_parser(name, help = help_text)
+        p.add_argument('--scenario', choices = sorted(va_core.DEFAULTS), default = 'scenario1')
+        p.add_argument('--target', type = float, required = True, help = 'Yearly after tax income.')
+        p.add_argument('--measure', choices = MEASURES, default = 'min')
+        p.add_argument('--set', action = 'append', metavar = 'NAME=VALUE', help = 'Other scenario arguments.')
+        p.add_argument('--years-dist', type = int, default = 10)
+        p.add_argument('--workers', type = int, help = 'Solve each batch in this many processes.')
+        if name == 'amount':
+            p.add_argument('--years-inv', type = int, default = 10)
+            p.add_argument('--reserve-ratio', type = float, help = 'scenario2: reserve fund as a share of the amount.')
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        raise SystemExit(2)
+
+    executor = None
+    if args.workers:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(args.workers)
+    params = parse_assignments(args.set, args.scenario)
+    try:
+        if args.command == 'amount':
+            plan = solve_amount(args.scenario, args.target, params, args.measure, args.years_inv, args.years_dist,
+                                args.reserve_ratio, executor = executor)
+        else:
+            plan = solve_years(args.scenario, args.target, params, args.measure, args.years_dist, executor = executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    print(json.dumps({plan.variable: plan.value,
+                      'income': plan.income,
+                      'target': plan.target,
+                      'measure': plan.measure,
+                      'distribution': plan.result.distribution if plan.result else None,
+                      'converged': plan.converged,
+                      'cost': plan.cost()}, indent = 2))
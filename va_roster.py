@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Client roster ingest.
+
+A roster is a CSV with one client per row:
+
+    client_id,scenario,initial_amount,reserve_fund,muni_roi,equity_roi,muni_int,equity_div,proportion
+    C0001,scenario1,1000000,,,,,,50
+    C0002,scenario2,950000,190000,0.01,0.05,0.03,0.03,40
+
+client_id, scenario and initial_amount are required; a blank cell (or a
+missing column) takes the scenario's default, and reserve_fund is ignored
+for scenario1. Optional advisor and region columns are carried through as
+text for va_cube. Other columns are skipped.
+
+roster_reader reads the file in chunks and validates each chunk with array
+operations, with the ranges of va_core.check_params: numbers must parse and
+be finite, proportion must be 0-100, returns above 0 and at most 1, income
+rates 0-1 (muni_int above 0 for scenario2), amounts non-negative and, for
+scenario2, initial_amount at least va_core.MIN_INVESTED above reserve_fund.
+Invalid rows are appended to a rejects CSV with the reason and the run
+carries on. Valid rows come out as roster_chunks of arrays, and
+roster_clients turns those into (client_id, scenario_config) pairs for
+va_batch. A valid row whose solve still fails is added to the rejects by
+rejects_sink:
+
+    python va_roster.py roster.csv --rejects rejects.csv --engine fast --store roster.vastore
+"""
+
+from collections import namedtuple
+
+import va_core
+
+#Column dtypes after validation. The file is read as text and the numeric
+#columns converted with to_numeric, so one bad cell rejects its row instead
+#of failing the whole chunk.
+ROSTER_DTYPES = {
+    'client_id': 'object',
+    'scenario': 'object',
+    'initial_amount': 'float64',
+    'reserve_fund': 'float64',
+    'muni_roi': 'float64',
+    'equity_roi': 'float64',
+    'muni_int': 'float64',
+    'equity_div': 'float64',
+    'proportion': 'float64',
+    'advisor': 'object',
+    'region': 'object',
+}
+NUMERIC = [col for col, dtype in ROSTER_DTYPES.items() if dtype == 'float64']
+REQUIRED = ('client_id', 'scenario', 'initial_amount')
+#Text columns passed through to roster_clients(attributes=...).
+ATTRIBUTES = ('advisor', 'region')
+
+#Valid rows of one chunk. client_id and scenario are object arrays, params
+#maps argument name -> float64 array (NaN where the scenario has no such argument),
+#attributes maps advisor/region (when the roster has them) -> object array,
+#row is the 1-based row number of each client in the file.
+roster_chunk = namedtuple('roster_chunk', ['client_id', 'scenario', 'params', 'attributes', 'row'])
+
+
+def validate(raw):
+    """
+    Validates one chunk of the roster as read (all text, '' for blank).
+    Returns (roster_chunk of the valid rows, DataFrame of the invalid rows
+    with a reason column). A row gets the first reason that applies.
+    """
+    import numpy as np
+    import pandas as pd
+    reasons = np.full(len(raw), '', dtype=object)
+
+    def reject(mask, reason):
+        mask = np.asarray(mask) & (reasons == '')
+        reasons[mask] = reason
+
+    client_id = raw['client_id'].str.strip()
+    kind = raw['scenario'].str.strip()
+    reject((client_id == '').to_numpy(), 'missing client_id')
+    reject((~kind.isin(list(va_core.DEFAULTS))).to_numpy(), 'unknown scenario')
+    kind = kind.to_numpy()
+
+    values = {}
+    for col in NUMERIC:
+        if col in raw:
+            text = raw[col].str.strip()
+        else:
+            text = pd.Series('', index=raw.index, dtype=object)
+        blank = (text == '').to_numpy()
+        if col in REQUIRED:
+            reject(blank, 'missing %s' % col)
+        number = pd.to_numeric(text.where(~blank), errors='coerce').to_numpy(dtype='float64')
+        reject(~blank & np.isnan(number), '%s is not a number' % col)
+        reject(np.isinf(number), '%s is not finite' % col)
+        for name, defaults in va_core.DEFAULTS.items():
+            rows = kind == name
+            if col in defaults:
+                number[blank & rows] = defaults[col]
+            else:
+                number[rows] = np.nan
+        values[col] = number
+
+    amount = values['initial_amount']
+    reserve = values['reserve_fund']
+    proportion = values['proportion']
+    scenario2 = kind == 'scenario2'
+    reject(~((proportion >= 0) & (proportion <= 100)), 'proportion outside 0-100')
+    for col in ('muni_roi', 'equity_roi'):
+        reject(~((values[col] > 0) & (values[col] <= 1)), '%s not above 0 and at most 1' % col)
+    for col in ('muni_int', 'equity_div'):
+        reject(~((values[col] >= 0) & (values[col] <= 1)), '%s outside 0-1' % col)
+    reject(scenario2 & ~(values['muni_int'] > 0), 'muni_int is 0 for scenario2')
+    reject(amount < 0, 'negative initial_amount')
+    reject(scenario2 & (reserve < 0), 'negative reserve_fund')
+    reject(scenario2 & ~(amount - reserve >= va_core.MIN_INVESTED),
+           'initial_amount less than %d above reserve_fund' % va_core.MIN_INVESTED)
+
+    ok = reasons == ''
+    attributes = {col: raw[col].str.strip().to_numpy()[ok] for col in ATTRIBUTES if col in raw}
+    chunk = roster_chunk(client_id.to_numpy()[ok], kind[ok], {col: values[col][ok] for col in NUMERIC}, attributes,
+                         raw.index.to_numpy()[ok])
+    rejects = raw.loc[~ok].assign(reason=reasons[~ok])
+    return chunk, rejects
+
+
+class roster_reader(object):
+    def __init__(self, path, rejects_path=None, chunksize=50000):
+        """
+        Iterating yields a roster_chunk per chunk of chunksize rows. Invalid
+        rows go to rejects_path (a CSV with the roster columns, the 1-based
+        row number and the reason), or are only counted if it is None. The
+        file is rewritten on every run, so a clean run leaves only its header.
+        """
+        self.path = path
+        self.rejects_path = rejects_path
+        self.chunksize = chunksize
+        self.accepted = 0
+        self.rejected = 0
+        #roster columns as read, the layout of the rejects file
+        self.columns = None
+        self._rejects_started = False
+
+    def __iter__(self):
+        import pandas as pd
+        reader = pd.read_csv(self.path, dtype=str, keep_default_na=False, chunksize=self.chunksize,
+                             usecols=lambda col: col.strip() in ROSTER_DTYPES)
+        row = 1
+        self._rejects_started = False
+        for raw in reader:
+            raw.columns = [col.strip() for col in raw.columns]
+            missing = [col for col in REQUIRED if col not in raw.columns]
+            if missing:
+                raise ValueError("%s has no %s column." % (self.path, ', '.join(missing)))
+            if self.columns is None:
+                self.columns = list(raw.columns)
+            if not self._rejects_started:
+                self._write_rejects(raw.iloc[:0].assign(reason=''), header_only=True)
+            raw.index = range(row, row + len(raw))
+            row += len(raw)
+            chunk, rejects = validate(raw)
+            self.accepted += len(chunk.client_id)
+            self.rejected += len(rejects)
+            self._write_rejects(rejects)
+            if len(chunk.client_id):
+                yield chunk
+        if not self._rejects_started:
+            #An empty roster: still replace the last run's rejects.
+            import pandas as pd
+            self._write_rejects(pd.DataFrame(columns=list(REQUIRED) + ['reason']), header_only=True)
+
+    def _write_rejects(self, rejects, header_only=False):
+        #Opened per write: rejects are rare, and a solve failure can come in after the last chunk.
+        if (not len(rejects) and not header_only) or self.rejects_path is None:
+            return
+        with open(self.rejects_path, 'a' if self._rejects_started else 'w', newline='') as fh:
+            rejects.to_csv(fh, header=not self._rejects_started, index_label='row')
+        self._rejects_started = True
+
+    def reject_client(self, row, client_id, kind, params, reason):
+        """Adds a client that passed validation but could not be solved to the rejects."""
+        import pandas as pd
+        values = dict((col, params.get(col, '')) for col in self.columns or [])
+        values.update(client_id=client_id, scenario=kind, reason=reason)
+        self.accepted -= 1
+        self.rejected += 1
+        self._write_rejects(pd.DataFrame([values], index=[row], columns=list(self.columns or []) + ['reason']))
+
+
+def roster_clients(chunks, attributes=None, rows=None):
+    """
+    (client_id, va_core.scenario_config) pairs from roster_chunks, for
+    va_batch.run_batch. If attributes is a dict, each client's advisor and
+    region are put in attributes[client_id] just before it is yielded (see
+    va_cube.cube_sink). rows works the same way for the row number (see
+    rejects_sink).
+    """
+    for chunk in chunks:
+        #tolist() gives plain Python values, which the sinks can write as JSON.
+        columns = [(col, values.tolist()) for col, values in chunk.params.items()]
+        text = [(col, values.tolist()) for col, values in chunk.attributes.items()]
+        row_numbers = chunk.row.tolist()
+        for i, (client_id, kind) in enumerate(zip(chunk.client_id.tolist(), chunk.scenario.tolist())):
+            defaults = va_core.DEFAULTS[kind]
+            params = {col: values[i] for col, values in columns if col in defaults}
+            if attributes is not None:
+                attributes[client_id] = {col: values[i] for col, values in text}
+            if rows is not None:
+                rows[client_id] = row_numbers[i]
+            yield client_id, va_core.scenario_config(kind, **params)
+
+
+class rejects_sink(object):
+    def __init__(self, reader, rows):
+        """
+        A va_batch sink that adds the clients whose solve failed to the
+        reader's rejects file. rows is the dict given to roster_clients; an
+        entry is dropped once its client is done.
+        """
+        self.reader = reader
+        self.rows = rows
+
+    def write(self, chunk):
+        if chunk.table == 'failed':
+            self.reader.reject_client(self.rows.pop(chunk.client_id, ''), chunk.client_id, chunk.scenario,
+                                      chunk.params, 'solve failed: %s' % chunk.metrics['error'])
+        elif chunk.table == 'distributions':
+            self.rows.pop(chunk.client_id, None)
+
+    def close(self):
+        pass
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import va_batch
+    parser = argparse.ArgumentParser(description = 'Validate a client roster and run it through the batch engine.')
+    parser.add_argument('roster')
+    parser.add_argument('--rejects', default = 'rejects.csv', help = 'CSV for invalid rows.')
+    parser.add_argument('--chunksize', type = int, default = 50000)
+    parser.add_argument('--engine', choices = ['reference', 'fast'], default = 'fast')
+    parser.add_argument('--years-inv', type = int, default = 10)
+    parser.add_argument('--years-dist', type = int, default = 10)
+    out = parser.add_mutually_exclusive_group(required = True)
+    out.add_argument('--csv-dir', help = 'Write batch_<table>_<scenario>.csv files here.')
+    out.add_argument('--store', help = 'Write one va_store file.')
+    parser.add_argument('--cube', help = 'Also save a va_cube aggregate (JSON) here.')
+    args = parser.parse_args()
+
+    reader = roster_reader(args.roster, args.rejects, args.chunksize)
+    if args.store:
+        sink = va_batch.store_sink(args.store, {'roster': args.roster})
+    else:
+        sink = va_batch.csv_sink(args.csv_dir)
+    #Only the cube sink drops attributes entries, so without it they would pile up for the whole roster.
+    attributes = {} if args.cube else None
+    rows = {}
+    sink = va_batch.tee_sink(rejects_sink(reader, rows), sink)
+    if args.cube:
+        from va_cube import book_cube, cube_sink
+        cube = book_cube()
+        sink = va_batch.tee_sink(sink, cube_sink(cube, attributes))
+    start = time.perf_counter()
+    va_batch.run_batch(roster_clients(reader, attributes, rows), sink, args.years_inv, args.years_dist, engine = args.engine)
+    if args.cube:
+        cube.save(args.cube)
+    print("%d clients run, %d rows rejected (see %s), %.2fs" % (reader.accepted, reader.rejected, args.rejects, time.perf_counter() - start))
@@ -29,14 +29,19 @@ to generate data to chart for each year.
 
 '''
 
-import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
+import time
+
+from va_metrics import solve_metrics, stage
 
 #%matplotlib inline
 
+from va_core import TAX_SCHEDULE_VERSION, STATE_SCHEDULE, CORP_SCHEDULE, bracket_index, scenario_config, solve_config
+
 class scenario_one(object):
-    def __init__(self, initial_amount=1000000, muni_roi = 1/100, equity_roi = 5/100, muni_int = 3/100, equity_div = 3/100, proportion = 50):
+    #Constructor arguments, saved alongside exported results.
+    param_names = ('initial_amount', 'muni_roi', 'equity_roi', 'muni_int', 'equity_div', 'proportion')
+    
+    def __init__(self, initial_amount=1000000, muni_roi = 1/100, equity_roi = 5/100, muni_int = 3/100, equity_div = 3/100, proportion = 50, hook = None):
         """
         Scenario One calculates returns with assumptions about investments made,
         taxes, and distributions.
@@ -45,6 +50,8 @@ class scenario_one(object):
         
         Proportion is the proportion of the portfolio dedicated to Munis.
         So Equity Investments are 1-proportion/100
+        
+        hook is passed to the instance's solve_metrics (see va_metrics).
         """
         self.initial_amount = initial_amount
         self.muni_roi = muni_roi
@@ -54,6 +61,11 @@ class scenario_one(object):
         self.fed_tax = 39.6/100
         self.state_tax = 5.75/100
         self.aca_tax = 3.8/100
+        self.proportion = proportion
+        #solver and stage timings, see va_metrics
+        self.metrics = solve_metrics(hook)
+        #immutable copy of the arguments, for solve()
+        self.config = scenario_config('scenario1', **scenario_params(self))
         self.net_init_amount = round(self.initial_amount * (1 - (self.fed_tax + self.state_tax + self.aca_tax)),2)
         self.muni_amount = round(self.net_init_amount*(proportion/100),2)
         self.equity_amount = round(self.net_init_amount*(1-proportion/100),2)
@@ -79,29 +91,27 @@ class scenario_one(object):
         
         """
         #muni basis each year is the muni_amount + all prior year's interest
-        self.muni_appreciated = round(investment[0] * (1+self.muni_roi),2)
-        self.equity_appreciated = round(investment[1] * (1+self.equity_roi),2)
+        muni_appreciated = round(investment[0] * (1+self.muni_roi),2)
+        equity_appreciated = round(investment[1] * (1+self.equity_roi),2)
         
         #Interest and Dividends, pretax
-        self.pretax_interest = round(investment[0]*self.muni_int,2)
-        self.pretax_dividends = round(investment[1]*self.equity_div,2)
+        pretax_interest = round(investment[0]*self.muni_int,2)
+        pretax_dividends = round(investment[1]*self.equity_div,2)
         
-        #State Tax Schedule
-        if self.pretax_dividends+self.pretax_interest <= 3000:
-            self.muni_int_earned = round(self.pretax_interest*(1-2/100),2)
-            self.equity_div_earned = round(self.pretax_dividends*(1-(20+3.8+2)/100),2)
-        elif (self.pretax_dividends+self.pretax_interest > 3000) & (self.pretax_dividends+self.pretax_interest <= 5000):
-            self.muni_int_earned = round(self.pretax_interest*(1-3/100),2)
-            self.equity_div_earned = round(self.pretax_dividends*(1-(20+3.8+3)/100),2)
-        elif (self.pretax_dividends+self.pretax_interest > 5000) & (self.pretax_dividends+self.pretax_interest <= 17000):
-            self.muni_int_earned = round(self.pretax_interest*(1-5/100),2)
-            self.equity_div_earned = round(self.pretax_dividends*(1-(20+3.8+5)/100),2)
-        else:
-            self.muni_int_earned = round(self.pretax_interest*(1-5.75/100),2)
-            self.equity_div_earned = round(self.pretax_dividends*(1-(20+3.8+5.75)/100),2)
-        return (self.muni_appreciated, self.muni_int_earned, self.equity_appreciated, self.equity_div_earned)
-    
+        #State Tax Schedule, kept in va_core.STATE_SCHEDULE:
+        #(upper bound of interest + dividends, muni interest rate %, dividend rate % incl. 20% + 3.8% ACA)
+        upper, muni_rate, eq_rate = STATE_SCHEDULE[bracket_index(STATE_SCHEDULE, pretax_dividends+pretax_interest)]
+        muni_int_earned = round(pretax_interest*(1-muni_rate/100),2)
+        equity_div_earned = round(pretax_dividends*(1-eq_rate/100),2)
+        return (muni_appreciated, muni_int_earned, equity_appreciated, equity_div_earned)
     
+    def solve(self, years_inv = 10, years_dist = 10, distribution = 0):
+        """
+        total_returns() and distributions() in one call, with the fast engine.
+        Returns a va_core.solve_result and leaves the instance untouched, so
+        one instance can be solved from several threads at once.
+        """
+        return solve_config(self.config, years_inv, years_dist, distribution)
         
     
     def total_returns(self, years_inv = 10, years_dist = 10):
@@ -118,7 +128,8 @@ class scenario_one(object):
         
         Cap gains are taxed at 20% + 3.8% ACA tax + 5.75% VA state tax rate.
         """
-        
+        import pandas as pd
+        start = time.perf_counter()
         muni_bases = []
         muni_ending = []
         muni_cap_appr = []
@@ -161,6 +172,7 @@ class scenario_one(object):
         #bases would be 260K in year 0, 260K + 260K + last year's int in year 1, 
         self.total_df = pd.DataFrame([inv_year,muni_bases, muni_ending, muni_cap_appr, muni_interest, equity_bases, equity_ending, equity_cap_appr, equity_div]).T.rename(columns = {0: 'Starting Year', 1:'muni_cost', 2:'muni_end_amt', 3: 'muni_capgain', 4:'net_int', 5: 'equity_cost', 6: 'equity_end_amt', 7: 'equity_cap_gain', 8:'net_div'}).set_index('Starting Year')
         
+        self.metrics.add_time('total_returns', time.perf_counter() - start)
         return self.total_df
         
         #return (muni_bases, muni_ending, muni_cap_appr, muni_interest)
@@ -181,6 +193,8 @@ class scenario_one(object):
         before then.
         """
         
+        start = time.perf_counter()
+        self.metrics.start_solve()
         #Starting dist
         if distribution == 0:
             distribution = (self.total_df.copy()['equity_end_amt'].ix[9]+self.total_df.copy()['muni_end_amt'].ix[9]+self.total_df.copy()['net_int'].ix[9]+self.total_df.copy()['net_div'].ix[9])/(years_dist-2)
@@ -194,8 +208,9 @@ class scenario_one(object):
             distribution,  self.dist_df, self.dist_info = self.goal_seek(distribution, years_dist, -2, 10)
             distribution, self.dist_df, self.dist_info = self.goal_seek(distribution, years_dist, -1, 1)
             distribution,   self.dist_df, self.dist_info = self.goal_seek(distribution, years_dist, 0, .1)
-            print ("Final iteration done. Goal found.")
 
+        self.metrics.solved(distribution, distribution - self.dist_df.muni_start[20] - self.dist_df.net_int[20])
+        self.metrics.add_time('solve', time.perf_counter() - start)
         return (self.dist_df, self.dist_info)
 
         
@@ -387,16 +402,19 @@ class scenario_one(object):
         capgain_adjuster = 1-(20)/100
         #converge = False
         tracker = 0
+        #Portfolio at the start of the distribution period, the same for every pass.
+        start_row = self.total_df.ix[9]
+        last_pass = None
         while tracker <=1000:
             #print (tracker)
             temp_muni_end = []
-            temp_interest = [self.total_df.copy()['net_int'].ix[9]]
+            temp_interest = [start_row['net_int']]
             temp_eq_end = []
-            temp_div = [self.total_df.copy()['net_div'].ix[9]]
-            temp_muni_start = [self.total_df.copy()['muni_end_amt'].ix[9]]
-            temp_eq_start = [self.total_df.copy()['equity_end_amt'].ix[9]]
-            temp_muni_bases = [self.total_df.copy()['muni_cost'].ix[9]]
-            temp_eq_bases = [self.total_df.copy()['equity_cost'].ix[9]]
+            temp_div = [start_row['net_div']]
+            temp_muni_start = [start_row['muni_end_amt']]
+            temp_eq_start = [start_row['equity_end_amt']]
+            temp_muni_bases = [start_row['muni_cost']]
+            temp_eq_bases = [start_row['equity_cost']]
             dists = []
             tax_list = []
             dist_nondiv = []
@@ -548,42 +566,38 @@ class scenario_one(object):
             if round(distribution - temp_muni_start[-1] - temp_interest[-1],rounder) > 0:
                 distribution -= increment
                 
-                self.dist_df = pd.DataFrame([inv_year,temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div ]).T.rename(columns = {0: 'Starting Year', 1: 'muni_start', 2:'muni_cost', 3:'muni_end_amt', 4:'net_int', 5: 'eq_start', 6: 'equity_cost', 7: 'equity_end_amt', 8:'net_div'}).set_index('Starting Year')
-                self.dist_info = pd.DataFrame([inv_year, dists, dist_nondiv, tax_list]).T.rename(columns = {0:'Starting Year', 1:'dists', 2:'nondivint_dists', 3: 'capgains_paid'}).set_index('Starting Year')
-                self.dist_info = self.dist_info.assign(after_tax_income = self.dist_info.dists - self.dist_info.capgains_paid)
+                last_pass = (inv_year, temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div, dists, dist_nondiv, tax_list)
             elif round(distribution - temp_muni_start[-1] - temp_interest[-1],rounder) < 0:
                 distribution += increment
                 
-                self.dist_df = pd.DataFrame([inv_year,temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div ]).T.rename(columns = {0: 'Starting Year', 1: 'muni_start', 2:'muni_cost', 3:'muni_end_amt', 4:'net_int', 5: 'eq_start', 6: 'equity_cost', 7: 'equity_end_amt', 8:'net_div'}).set_index('Starting Year')
-                self.dist_info = pd.DataFrame([inv_year, dists, dist_nondiv, tax_list]).T.rename(columns = {0:'Starting Year', 1:'dists', 2:'nondivint_dists', 3: 'capgains_paid'}).set_index('Starting Year')
-                self.dist_info = self.dist_info.assign(after_tax_income = self.dist_info.dists - self.dist_info.capgains_paid)
+                last_pass = (inv_year, temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div, dists, dist_nondiv, tax_list)
             elif round(distribution - temp_muni_start[-1] - temp_interest[-1],rounder) == 0:
                 #if round(distribution - temp_muni_start[-1] - temp_interest[-1],0) == 0:
 #                inv_year = list(range(10,21))
-                print ("Distribution Amount per year:", distribution)
-                print ("Ending Amount:", temp_muni_start[-1] + temp_interest[-1])
-                print ("Loops:", tracker)
-                self.dist_df = pd.DataFrame([inv_year,temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div ]).T.rename(columns = {0: 'Starting Year', 1: 'muni_start', 2:'muni_cost', 3:'muni_end_amt', 4:'net_int', 5: 'eq_start', 6: 'equity_cost', 7: 'equity_end_amt', 8:'net_div'}).set_index('Starting Year')
-                self.dist_info = pd.DataFrame([inv_year, dists, dist_nondiv, tax_list]).T.rename(columns = {0:'Starting Year', 1:'dists', 2:'nondivint_dists', 3: 'capgains_paid'}).set_index('Starting Year')
-                self.dist_info = self.dist_info.assign(after_tax_income = self.dist_info.dists - self.dist_info.capgains_paid)
+                self.metrics.goal_seek_done(rounder, increment, tracker, distribution, temp_muni_start[-1] + temp_interest[-1], True)
+                last_pass = (inv_year, temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div, dists, dist_nondiv, tax_list)
                 #converge = True
                 break
             
             #Tracker for if loops do not converge.
             if tracker == 2000:
-                print ("Distribution Amount per year:", distribution)
-                print ("Ending Amount:", temp_muni_start[-1] + temp_interest[-1])
-                print ("Loops:", tracker)
-                print ("Try re-running with a different starting distribution.")
-                self.dist_df = pd.DataFrame([inv_year,temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div ]).T.rename(columns = {0: 'Starting Year', 1: 'muni_start', 2:'muni_cost', 3:'muni_end_amt', 4:'net_int', 5: 'eq_start', 6: 'equity_cost', 7: 'equity_end_amt', 8:'net_div'}).set_index('Starting Year')
-                self.dist_info = pd.DataFrame([inv_year, dists, dist_nondiv, tax_list]).T.rename(columns = {0:'Starting Year', 1:'dists', 2:'nondivint_dists', 3: 'capgains_paid'}).set_index('Starting Year')
-                self.dist_info = self.dist_info.assign(after_tax_income = self.dist_info.dists - self.dist_info.capgains_paid)
+                self.metrics.goal_seek_done(rounder, increment, tracker, distribution, temp_muni_start[-1] + temp_interest[-1], False)
+                last_pass = (inv_year, temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div, dists, dist_nondiv, tax_list)
                 break
-        return (distribution, self.dist_df, self.dist_info)
+        else:
+            #Loop cap reached without finding the goal.
+            self.metrics.goal_seek_done(rounder, increment, tracker, distribution, temp_muni_start[-1] + temp_interest[-1], False)
+        #Frames are only built for the last pass, which is what is returned.
+        if last_pass is None:
+            return (distribution, self.dist_df, self.dist_info)
+        dist_df, dist_info = dist_frames(*last_pass)
+        return (distribution, dist_df, dist_info)
 
 
 class scenario_two(object):
-    def __init__(self, initial_amount=950000, reserve_fund = 190000, muni_roi = 1/100, equity_roi = 5/100, muni_int = 3/100, equity_div = 3/100, proportion = 50):
+    param_names = ('initial_amount', 'reserve_fund', 'muni_roi', 'equity_roi', 'muni_int', 'equity_div', 'proportion')
+    
+    def __init__(self, initial_amount=950000, reserve_fund = 190000, muni_roi = 1/100, equity_roi = 5/100, muni_int = 3/100, equity_div = 3/100, proportion = 50, hook = None):
         """
         Scenario Two calculates returns with assumptions about investments made,
         taxes, and distributions.
@@ -599,6 +613,8 @@ class scenario_two(object):
         
         Proportion is the proportion of the portfolio dedicated to Munis.
         So Equity Investments are 1-proportion/100
+        
+        hook is passed to the instance's solve_metrics (see va_metrics).
         """
         self.initial_amount = initial_amount
         self.muni_roi = muni_roi
@@ -606,6 +622,11 @@ class scenario_two(object):
         self.muni_int = muni_int
         self.equity_div = equity_div
         self.reserve_fund = reserve_fund
+        self.proportion = proportion
+        #solver and stage timings, see va_metrics
+        self.metrics = solve_metrics(hook)
+        #immutable copy of the arguments, for solve()
+        self.config = scenario_config('scenario2', **scenario_params(self))
         self.muni_yr1 = round((self.initial_amount-self.reserve_fund)*(proportion/100),2)
         self.eq_yr1 = round((self.initial_amount-self.reserve_fund)*(1-proportion/100),2)
         #For years 2-10.
@@ -635,45 +656,34 @@ class scenario_two(object):
         
         
         #muni basis each year is the muni_amount + all prior year's interest
-        self.muni_appreciated = round(investment[0] * (1+self.muni_roi),2)
-        self.equity_appreciated = round(investment[1] * (1+self.equity_roi),2)
+        muni_appreciated = round(investment[0] * (1+self.muni_roi),2)
+        equity_appreciated = round(investment[1] * (1+self.equity_roi),2)
         
         #Interest and Dividends, pretax
-        self.pretax_interest = round(investment[0]*self.muni_int,2)
-        self.pretax_dividends = round(investment[1]*self.equity_div,2)
-        
-        muni_percent = self.pretax_interest/(self.pretax_interest+self.pretax_dividends)
+        pretax_interest = round(investment[0]*self.muni_int,2)
+        pretax_dividends = round(investment[1]*self.equity_div,2)
         
-        #Corp Tax Schedule
-        if self.pretax_dividends+self.pretax_interest <= 50000:
-            self.muni_int_earned = round(self.pretax_interest*(1-15/100),2)
-            self.equity_div_earned = round(self.pretax_dividends*(1-15/100),2)
-        elif (self.pretax_dividends+self.pretax_interest > 50000) & (self.pretax_dividends+self.pretax_interest <= 75000):
-            #Will split the amount proportionally.
-            self.muni_int_earned = round((self.pretax_interest-(7500*muni_percent))*(1-25/100),2)
-            self.equity_div_earned = round((self.pretax_dividends-(7500*(1-muni_percent)))*(1-25/100),2)
-        elif (self.pretax_dividends+self.pretax_interest > 75000) & (self.pretax_dividends+self.pretax_interest <= 100000):
-            self.muni_int_earned = round((self.pretax_interest-(13750*muni_percent))*(1-34/100),2)
-            self.equity_div_earned = round((self.pretax_dividends-(13750*(1-muni_percent)))*(1-34/100),2)
-        elif (self.pretax_dividends+self.pretax_interest > 100000) & (self.pretax_dividends+self.pretax_interest <= 335000):
-            self.muni_int_earned = round((self.pretax_interest-(22250*muni_percent))*(1-39/100),2)
-            self.equity_div_earned = round((self.pretax_dividends-(22250*(1-muni_percent)))*(1-39/100),2)
-        elif (self.pretax_dividends+self.pretax_interest > 335000) & (self.pretax_dividends+self.pretax_interest <= 10000000):
-            self.muni_int_earned = round((self.pretax_interest-(113900*muni_percent))*(1-34/100),2)
-            self.equity_div_earned = round((self.pretax_dividends-(113900*(1-muni_percent)))*(1-34/100),2)
-        elif (self.pretax_dividends+self.pretax_interest > 10000000) & (self.pretax_dividends+self.pretax_interest <= 15000000):
-            self.muni_int_earned = round((self.pretax_interest-(3400000*muni_percent))*(1-35/100),2)
-            self.equity_div_earned = round((self.pretax_dividends-(3400000*(1-muni_percent)))*(1-35/100),2)
-        elif (self.pretax_dividends+self.pretax_interest > 15000000) & (self.pretax_dividends+self.pretax_interest <= 18333333):
-            self.muni_int_earned = round((self.pretax_interest-(5150000*muni_percent))*(1-38/100),2)
-            self.equity_div_earned = round((self.pretax_dividends-(5150000*(1-muni_percent)))*(1-38/100),2)
+        muni_percent = pretax_interest/(pretax_interest+pretax_dividends)
         
+        #Corp Tax Schedule, kept in va_core.CORP_SCHEDULE:
+        #(upper bound of interest + dividends, amount deducted or None, rate %)
+        upper, deduction, rate = CORP_SCHEDULE[bracket_index(CORP_SCHEDULE, pretax_dividends+pretax_interest)]
+        if deduction is None:
+            muni_int_earned = round(pretax_interest*(1-rate/100),2)
+            equity_div_earned = round(pretax_dividends*(1-rate/100),2)
         else:
-            self.muni_int_earned = round(self.pretax_interest*(1-35/100),2)
-            self.equity_div_earned = round(self.pretax_dividends*(1-35/100),2)
-        return (self.muni_appreciated, self.muni_int_earned, self.equity_appreciated, self.equity_div_earned)
-    
+            #Will split the amount proportionally.
+            muni_int_earned = round((pretax_interest-(deduction*muni_percent))*(1-rate/100),2)
+            equity_div_earned = round((pretax_dividends-(deduction*(1-muni_percent)))*(1-rate/100),2)
+        return (muni_appreciated, muni_int_earned, equity_appreciated, equity_div_earned)
     
+    def solve(self, years_inv = 10, years_dist = 10, distribution = 0):
+        """
+        total_returns() and distributions() in one call, with the fast engine.
+        Returns a va_core.solve_result and leaves the instance untouched, so
+        one instance can be solved from several threads at once.
+        """
+        return solve_config(self.config, years_inv, years_dist, distribution)
         
     
     def total_returns(self, years_inv = 10):
@@ -690,6 +700,8 @@ class scenario_two(object):
         
         Cap gains are taxed at 20% + 3.8% ACA tax + 5.75% VA state tax rate.
         """
+        import pandas as pd
+        start = time.perf_counter()
         reserve = []
         muni_bases = []
         muni_ending = []
@@ -734,6 +746,7 @@ class scenario_two(object):
         #bases needs to show the bases for each year.
         #bases would be 260K in year 0, 260K + 260K + last year's int in year 1, 
         self.total_df = pd.DataFrame([inv_year,reserve, muni_bases, muni_ending, muni_cap_appr, muni_interest, equity_bases, equity_ending, equity_cap_appr, equity_div]).T.rename(columns = {0: 'Starting Year', 1:'reserve', 2:'muni_cost', 3:'muni_end_amt', 4: 'muni_capgain', 5:'net_int', 6: 'equity_cost', 7: 'equity_end_amt', 8: 'equity_cap_gain', 9:'net_div'}).set_index('Starting Year')
+        self.metrics.add_time('total_returns', time.perf_counter() - start)
         return self.total_df
         #return (muni_bases, muni_ending, muni_cap_appr, muni_interest)
         
@@ -753,6 +766,8 @@ class scenario_two(object):
         before then.
         """
         
+        start = time.perf_counter()
+        self.metrics.start_solve()
         #Starting dist
         if distribution == 0:
             distribution = (self.total_df.copy()['equity_end_amt'].ix[9]+self.total_df.copy()['muni_end_amt'].ix[9]+self.total_df.copy()['net_int'].ix[9]+self.total_df.copy()['net_div'].ix[9])/(years_dist)
@@ -770,8 +785,9 @@ class scenario_two(object):
             distribution,  self.dist_df, self.dist_info = self.goal_seek(distribution, years_dist, -2, 10)
             distribution, self.dist_df, self.dist_info = self.goal_seek(distribution, years_dist, -1, 1)
             distribution,   self.dist_df, self.dist_info = self.goal_seek(distribution, years_dist, 0, .1)
-            print ("Final iteration done. Goal found.")
 
+        self.metrics.solved(distribution, distribution - self.dist_df.muni_start[20] - self.dist_df.net_int[20])
+        self.metrics.add_time('solve', time.perf_counter() - start)
         return (self.dist_df, self.dist_info)
 #       
 
@@ -779,16 +795,19 @@ class scenario_two(object):
         capgain_adjuster = 1-(20)/100
         #converge = False
         tracker = 0
+        #Portfolio at the start of the distribution period, the same for every pass.
+        start_row = self.total_df.ix[9]
+        last_pass = None
         while True:
             #print (tracker)
             temp_muni_end = []
-            temp_interest = [self.total_df.copy()['net_int'].ix[9]]
+            temp_interest = [start_row['net_int']]
             temp_eq_end = []
-            temp_div = [self.total_df.copy()['net_div'].ix[9]]
-            temp_muni_start = [self.total_df.copy()['muni_end_amt'].ix[9]]
-            temp_eq_start = [self.total_df.copy()['equity_end_amt'].ix[9]]
-            temp_muni_bases = [self.total_df.copy()['muni_cost'].ix[9]]
-            temp_eq_bases = [self.total_df.copy()['equity_cost'].ix[9]]
+            temp_div = [start_row['net_div']]
+            temp_muni_start = [start_row['muni_end_amt']]
+            temp_eq_start = [start_row['equity_end_amt']]
+            temp_muni_bases = [start_row['muni_cost']]
+            temp_eq_bases = [start_row['equity_cost']]
             dists = []
             tax_list = []
             dist_nondiv = []
@@ -940,77 +959,87 @@ class scenario_two(object):
             if round(distribution - temp_muni_start[-1] - temp_interest[-1],rounder) > 0:
                 distribution -= increment
                 
-                self.dist_df = pd.DataFrame([inv_year,temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div ]).T.rename(columns = {0: 'Starting Year', 1: 'muni_start', 2:'muni_cost', 3:'muni_end_amt', 4:'net_int', 5: 'eq_start', 6: 'equity_cost', 7: 'equity_end_amt', 8:'net_div'}).set_index('Starting Year')
-                self.dist_info = pd.DataFrame([inv_year, dists, dist_nondiv, tax_list]).T.rename(columns = {0:'Starting Year', 1:'dists', 2:'nondivint_dists', 3: 'capgains_paid'}).set_index('Starting Year')
-                self.dist_info = self.dist_info.assign(after_tax_income = self.dist_info.dists - self.dist_info.capgains_paid)
+                last_pass = (inv_year, temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div, dists, dist_nondiv, tax_list)
             elif round(distribution - temp_muni_start[-1] - temp_interest[-1],rounder) < 0:
                 distribution += increment
                 
-                self.dist_df = pd.DataFrame([inv_year,temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div ]).T.rename(columns = {0: 'Starting Year', 1: 'muni_start', 2:'muni_cost', 3:'muni_end_amt', 4:'net_int', 5: 'eq_start', 6: 'equity_cost', 7: 'equity_end_amt', 8:'net_div'}).set_index('Starting Year')
-                self.dist_info = pd.DataFrame([inv_year, dists, dist_nondiv, tax_list]).T.rename(columns = {0:'Starting Year', 1:'dists', 2:'nondivint_dists', 3: 'capgains_paid'}).set_index('Starting Year')
-                self.dist_info = self.dist_info.assign(after_tax_income = self.dist_info.dists - self.dist_info.capgains_paid)
+                last_pass = (inv_year, temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div, dists, dist_nondiv, tax_list)
             elif round(distribution - temp_muni_start[-1] - temp_interest[-1],rounder) == 0:
                 #if round(distribution - temp_muni_start[-1] - temp_interest[-1],0) == 0:
 #                inv_year = list(range(10,21))
-                print ("Distribution Amount per year:", distribution)
-                print ("Ending Amount:", temp_muni_start[-1] + temp_interest[-1])
-                print ("Loops:", tracker)
-                self.dist_df = pd.DataFrame([inv_year,temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div ]).T.rename(columns = {0: 'Starting Year', 1: 'muni_start', 2:'muni_cost', 3:'muni_end_amt', 4:'net_int', 5: 'eq_start', 6: 'equity_cost', 7: 'equity_end_amt', 8:'net_div'}).set_index('Starting Year')
-                self.dist_info = pd.DataFrame([inv_year, dists, dist_nondiv, tax_list]).T.rename(columns = {0:'Starting Year', 1:'dists', 2:'nondivint_dists', 3: 'capgains_paid'}).set_index('Starting Year')
-                self.dist_info = self.dist_info.assign(after_tax_income = self.dist_info.dists - self.dist_info.capgains_paid)
+                self.metrics.goal_seek_done(rounder, increment, tracker, distribution, temp_muni_start[-1] + temp_interest[-1], True)
+                last_pass = (inv_year, temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div, dists, dist_nondiv, tax_list)
                 #converge = True
                 break
             
             #Tracker for if loops do not converge.
             if tracker == 2000:
-                print ("Distribution Amount per year:", distribution)
-                print ("Ending Amount:", temp_muni_start[-1] + temp_interest[-1])
-                print ("Loops:", tracker)
-                print ("Try re-running with a different starting distribution.")
-                self.dist_df = pd.DataFrame([inv_year,temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div ]).T.rename(columns = {0: 'Starting Year', 1: 'muni_start', 2:'muni_cost', 3:'muni_end_amt', 4:'net_int', 5: 'eq_start', 6: 'equity_cost', 7: 'equity_end_amt', 8:'net_div'}).set_index('Starting Year')
-                self.dist_info = pd.DataFrame([inv_year, dists, dist_nondiv, tax_list]).T.rename(columns = {0:'Starting Year', 1:'dists', 2:'nondivint_dists', 3: 'capgains_paid'}).set_index('Starting Year')
-                self.dist_info = self.dist_info.assign(after_tax_income = self.dist_info.dists - self.dist_info.capgains_paid)
+                self.metrics.goal_seek_done(rounder, increment, tracker, distribution, temp_muni_start[-1] + temp_interest[-1], False)
+                last_pass = (inv_year, temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div, dists, dist_nondiv, tax_list)
                 break
-        return (distribution, self.dist_df, self.dist_info)
+        #Frames are only built for the last pass, which is what is returned.
+        if last_pass is None:
+            return (distribution, self.dist_df, self.dist_info)
+        dist_df, dist_info = dist_frames(*last_pass)
+        return (distribution, dist_df, dist_info)
 
-def combine_csvs(df_first10, df_dists):
-    df_combined = pd.concat([df_first10, df_dists])
-    #Fix Starting Equity Port Value
-    df_combined.set_value(0, 'eq_start', df_combined.equity_cost[0])
-    df_combined.set_value(0, 'muni_start', df_combined.muni_cost[0])
-    for i in range(0,9):
-        df_combined.set_value(i+1, 'eq_start', df_combined.equity_end_amt[i])
-        df_combined.set_value(i+1, 'muni_start', df_combined.muni_end_amt[i])
-    
-    #Fix Cap Gain
-    for i in range(10, 20):
-        df_combined.set_value(i, 'equity_cap_gain', df_combined.eq_start[i]-df_combined.equity_cost[i])
-        df_combined.set_value(i, 'muni_capgain', df_combined.muni_start[i]-df_combined.muni_cost[i])
+def dist_frames(inv_year, temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div, dists, dist_nondiv, tax_list):
+    """Builds the dist_df and dist_info DataFrames from one goal_seek pass."""
+    import pandas as pd
+    dist_df = pd.DataFrame([inv_year,temp_muni_start, temp_muni_bases, temp_muni_end, temp_interest, temp_eq_start, temp_eq_bases, temp_eq_end, temp_div ]).T.rename(columns = {0: 'Starting Year', 1: 'muni_start', 2:'muni_cost', 3:'muni_end_amt', 4:'net_int', 5: 'eq_start', 6: 'equity_cost', 7: 'equity_end_amt', 8:'net_div'}).set_index('Starting Year')
+    dist_info = pd.DataFrame([inv_year, dists, dist_nondiv, tax_list]).T.rename(columns = {0:'Starting Year', 1:'dists', 2:'nondivint_dists', 3: 'capgains_paid'}).set_index('Starting Year')
+    dist_info = dist_info.assign(after_tax_income = dist_info.dists - dist_info.capgains_paid)
+    return dist_df, dist_info
+
+
+def combine_csvs(df_first10, df_dists, metrics=None):
+    """
+    Stacks the first 10 years and the distribution years into one frame,
+    numbered 1 to 21, with a total_assets column. If metrics (a
+    va_metrics.solve_metrics) is passed, the time taken is added to it.
+    """
+    import pandas as pd
+    with stage(metrics, 'combine_csvs'):
+        df_combined = pd.concat([df_first10, df_dists])
+        #Fix Starting Equity Port Value
+        df_combined.set_value(0, 'eq_start', df_combined.equity_cost[0])
+        df_combined.set_value(0, 'muni_start', df_combined.muni_cost[0])
+        for i in range(0,9):
+            df_combined.set_value(i+1, 'eq_start', df_combined.equity_end_amt[i])
+            df_combined.set_value(i+1, 'muni_start', df_combined.muni_end_amt[i])
         
-    #Fill NA with 0.
-    df_combined = df_combined.fillna(0)
-    
-    #Create Total Assets column
-    df_combined = df_combined.assign(total_assets = df_combined.equity_end_amt + df_combined.muni_end_amt)
-    
-    #Set index to 1 to 21.
-    df_combined.set_index([list(range(1,22))], inplace = True)
-    df_combined.index.rename('Starting Year', inplace = True)
-   
+        #Fix Cap Gain
+        for i in range(10, 20):
+            df_combined.set_value(i, 'equity_cap_gain', df_combined.eq_start[i]-df_combined.equity_cost[i])
+            df_combined.set_value(i, 'muni_capgain', df_combined.muni_start[i]-df_combined.muni_cost[i])
+            
+        #Fill NA with 0.
+        df_combined = df_combined.fillna(0)
+        
+        #Create Total Assets column
+        df_combined = df_combined.assign(total_assets = df_combined.equity_end_amt + df_combined.muni_end_amt)
+        
+        #Set index to 1 to 21.
+        df_combined.set_index([list(range(1,22))], inplace = True)
+        df_combined.index.rename('Starting Year', inplace = True)
     return df_combined
 
-def after_tax_compare(info1, info2):
+def after_tax_compare(info1, info2, metrics=None):
     """Combines the distribution info dfs from Scen 1 and 2,
     gets the sum of the After Tax Incomes, and Difference.
+    
+    If metrics (a va_metrics.solve_metrics) is passed, the time taken is added to it.
     """
-    after_tax = pd.merge(info1, info2, left_index = True, right_index = True)
-    #Set index to 1 to 21
-    after_tax.set_index([list(range(11,22))], inplace = True)
-    #Difference in income columnn
-    after_tax = after_tax.assign(difference_income = after_tax.after_tax_income_y - after_tax.after_tax_income_x)
-    after_tax = after_tax.rename(columns = {'after_tax_income_x': 'income_scen1', 'after_tax_income_y': 'income_scen2'})
-    after_tax = after_tax[['income_scen1', 'income_scen2', 'difference_income']]
-    after_tax.index.rename('Starting Year', inplace = True)
+    import pandas as pd
+    with stage(metrics, 'after_tax_compare'):
+        after_tax = pd.merge(info1, info2, left_index = True, right_index = True)
+        #Set index to 1 to 21
+        after_tax.set_index([list(range(11,22))], inplace = True)
+        #Difference in income columnn
+        after_tax = after_tax.assign(difference_income = after_tax.after_tax_income_y - after_tax.after_tax_income_x)
+        after_tax = after_tax.rename(columns = {'after_tax_income_x': 'income_scen1', 'after_tax_income_y': 'income_scen2'})
+        after_tax = after_tax[['income_scen1', 'income_scen2', 'difference_income']]
+        after_tax.index.rename('Starting Year', inplace = True)
     return after_tax
 
 
@@ -1018,33 +1047,114 @@ def after_tax_compare(info1, info2):
 
     
    
-if __name__ == "__main__":
-    #run scenario one
-    client1 = scenario_one()
+def scenario_params(client):
+    """Returns the constructor parameters of a scenario instance, for saving with results."""
+    return {name: getattr(client, name) for name in client.param_names}
+
+
+def export_store(path, runs, after_tax=None):
+    """
+    Writes one run to a single columnar store file (see va_store) instead of CSVs.
+    
+    runs is a list of (client_name, scenario_name, client, first10, dist_df, dist_info),
+    after calling total_returns and distributions on each client.
+    after_tax is the output of after_tax_compare, if there is one.
+    """
+    from va_store import store_writer
+    with store_writer(path, metadata={'tax_schedule_version': TAX_SCHEDULE_VERSION}) as store:
+        for client_name, scenario_name, client, first10, dist_df, dist_info in runs:
+            params = scenario_params(client)
+            returns = combine_csvs(first10, dist_df, client.metrics)
+            store.append('first10', first10, client_name, scenario_name, params)
+            store.append('dists', dist_df, client_name, scenario_name, params)
+            store.append('distributions', dist_info, client_name, scenario_name, params)
+            store.append('totalreturns_all', returns, client_name, scenario_name, params)
+        if after_tax is not None:
+            store.append('income', after_tax)
+    return path
+
+
+def run_scenarios(params1=None, params2=None, hook=None, metrics=None):
+    """
+    Runs client1 (scenario one) and client2 (scenario two) with the reference
+    calculator. Returns (runs, after_tax) in the form export_store and
+    export_csvs take.
+    
+    hook goes to both clients' solve_metrics. after_tax_compare belongs to
+    neither client, so its time goes to metrics, a solve_metrics for the
+    run (a new one with hook if not given).
+    """
+    if metrics is None:
+        metrics = solve_metrics(hook)
+    client1 = scenario_one(hook = hook, **(params1 or {}))
     df_client1_first10 = client1.total_returns()
-    df_client1_first10.to_csv('first 10 years portfolio client1.csv')
     df1_dist, df1_info = client1.distributions()
-    df1_dist.to_csv('client1_dists.csv')
-    df1_info.to_csv('scenario1_distributions.csv')
-    df_returns = combine_csvs(df_client1_first10, df1_dist)
-    df_returns.to_csv('scenario1_totalreturns_all.csv', index_label = 'Starting Year')
-    tot_assets = pd.DataFrame(df_returns[['equity_end_amt', 'muni_end_amt']]) 
-    tot_assets.to_csv('scenario1_totalassets.csv', index_label = 'Starting Year')
     
-     #run scenario two
-    client2 = scenario_two()
+    client2 = scenario_two(hook = hook, **(params2 or {}))
     df_client2_first10 = client2.total_returns()
-    df_client2_first10.to_csv('first 10 years portfolio client2.csv')
     df2_dist, df2_info = client2.distributions()
-    df2_dist.to_csv('client2_dists.csv')
-    df2_info.to_csv('scenario2_distributions.csv')
-    df_returns2 = combine_csvs(df_client2_first10, df2_dist)
-    df_returns2.to_csv('scenario2_totalreturns_all.csv', index_label = 'Starting Year')
-    tot_assets2 = pd.DataFrame(df_returns2[['equity_end_amt', 'muni_end_amt']])
-    tot_assets2.to_csv('scenario2_totalassets.csv', index_label = 'Starting Year')
-    
     
     #Get After Tax Income for two scenarios
-    after_tax = after_tax_compare(df1_info, df2_info)
-    after_tax.to_csv('scenarios_income.csv', index_label = 'Starting Year')
-    
\ No newline at end of file
+    after_tax = after_tax_compare(df1_info, df2_info, metrics)
+    runs = [('client1', 'scenario1', client1, df_client1_first10, df1_dist, df1_info),
+            ('client2', 'scenario2', client2, df_client2_first10, df2_dist, df2_info)]
+    return runs, after_tax
+
+
+def log_stage_times(runs, metrics=None):
+    """Logs the stage times of each client of runs, and of the run itself from metrics."""
+    from va_metrics import logger
+    for client_name, scenario_name, client, first10, dist_df, dist_info in runs:
+        logger.info("%s stage times: %s", client_name, ', '.join('%s %.3fs' % kv for kv in sorted(client.metrics.stage_times.items())))
+    if metrics is not None:
+        logger.info("run stage times: %s", ', '.join('%s %.3fs' % kv for kv in sorted(metrics.stage_times.items())))
+
+
+def write_client_csvs(n, first10, dist_df, dist_info, df_returns, directory='.'):
+    """Writes the viz CSVs for client n (1 or 2) and returns their paths."""
+    import os
+    import pandas as pd
+    paths = [os.path.join(directory, name % n) for name in ('first 10 years portfolio client%d.csv', 'client%d_dists.csv',
+                                                             'scenario%d_distributions.csv', 'scenario%d_totalreturns_all.csv',
+                                                             'scenario%d_totalassets.csv')]
+    first10.to_csv(paths[0])
+    dist_df.to_csv(paths[1])
+    dist_info.to_csv(paths[2])
+    df_returns.to_csv(paths[3], index_label = 'Starting Year')
+    tot_assets = pd.DataFrame(df_returns[['equity_end_amt', 'muni_end_amt']])
+    tot_assets.to_csv(paths[4], index_label = 'Starting Year')
+    return paths
+
+
+def write_income_csv(after_tax, directory='.'):
+    import os
+    path = os.path.join(directory, 'scenarios_income.csv')
+    after_tax.to_csv(path, index_label = 'Starting Year')
+    return [path]
+
+
+def export_csvs(runs, after_tax, directory='.'):
+    """Writes the CSVs the viz page reads, for the runs from run_scenarios."""
+    for n, (client_name, scenario_name, client, first10, dist_df, dist_info) in enumerate(runs, 1):
+        write_client_csvs(n, first10, dist_df, dist_info, combine_csvs(first10, dist_df, client.metrics), directory)
+    write_income_csv(after_tax, directory)
+    return directory
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Run the two client scenarios and save the results.')
+    parser.add_argument('--format', choices = ['csv', 'store'], default = 'csv',
+                        help = 'csv writes the CSVs for the viz page, store writes one columnar file.')
+    parser.add_argument('--out', default = 'scenarios.vastore', help = 'Output file for --format store.')
+    args = parser.parse_args()
+    
+    import logging
+    logging.basicConfig(level = logging.INFO, format = '%(message)s')
+    report = solve_metrics()
+    runs, after_tax = run_scenarios(metrics = report)
+    if args.format == 'store':
+        export_store(args.out, runs, after_tax)
+    else:
+        export_csvs(runs, after_tax)
+    log_stage_times(runs, report)
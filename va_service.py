@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Local quoting service.
+
+A small asyncio HTTP server (standard library only) that answers scenario
+quotes while an advisor is on a call:
+
+    python va_service.py --port 8765 --workers 2
+
+    POST /quote
+    {"scenario1": {"initial_amount": 1000000},
+     "scenario2": {"initial_amount": 950000, "reserve_fund": 190000},
+     "years_dist": 10, "deadline_ms": 500}
+
+Either scenario can be left out. The reply has, per scenario, the solved
+distribution and the dist_info columns (dists, nondivint_dists,
+capgains_paid, after_tax_income), plus the after_tax_compare table when both
+are quoted. GET /health answers {"status": "ok"}.
+
+Parameters outside va_core.check_params get a 400. Solves run in a
+process pool with va_core. A request joins an identical solve already in
+flight if that solve was given at least the same deadline_ms. deadline_ms
+bounds the request: the solver stops at the deadline and returns its best
+point (converged false), a solve still queued at its deadline is skipped,
+and a request still waiting when its deadline passes gets a 504.
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import json
+import math
+import multiprocessing
+import time
+
+import va_core
+from va_metrics import logger
+
+DEFAULT_DEADLINE_MS = 2000
+MAX_BODY = 1 << 20
+
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+          413: 'Payload Too Large', 422: 'Unprocessable Entity', 500: 'Internal Server Error', 504: 'Gateway Timeout'}
+
+
+class quote_error(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def _json_safe(values):
+    #NaN is not valid JSON, send null instead.
+    return [None if isinstance(v, float) and math.isnan(v) else v for v in values]
+
+
+def quote_scenario(kind, params, years_dist, deadline):
+    """
+    Solves one scenario, stopping at deadline (a time.monotonic() value, which
+    the worker processes share with the server). Runs in a worker process.
+    Returns None without solving if the deadline passed while it was queued.
+    """
+    if time.monotonic() >= deadline:
+        return None
+    first10 = va_core.first10(kind, params)
+    p = dict(va_core.DEFAULTS[kind])
+    p.update(params)
+    distribution, sim, evaluations, converged = va_core.solve(kind, va_core.rates_of(p), va_core.start_state(first10),
+                                                              years_dist, deadline=deadline)
+    dist_df, dist_info = va_core.dist_tables(sim)
+    return {'distribution': distribution,
+            'residual': sim['residual'],
+            'converged': converged,
+            'evaluations': evaluations,
+            'dist_info': {col: _json_safe(values) for col, values in dist_info.items()}}
+
+
+def parse_quote(body):
+    """Validates a /quote body. Returns ({kind: params}, years_dist, deadline_ms)."""
+    try:
+        request = json.loads(body.decode('utf-8') or '{}')
+    except (UnicodeDecodeError, ValueError):
+        raise quote_error(400, "Body is not valid JSON.")
+    if not isinstance(request, dict):
+        raise quote_error(400, "Body must be a JSON object.")
+    scenarios = {}
+    for kind in ('scenario1', 'scenario2'):
+        if kind not in request:
+            continue
+        params = request[kind] or {}
+        if not isinstance(params, dict):
+            raise quote_error(400, "%s must be an object of parameters." % kind)
+        unknown = set(params) - set(va_core.DEFAULTS[kind])
+        if unknown:
+            raise quote_error(400, "Unknown %s parameters: %s." % (kind, ', '.join(sorted(unknown))))
+        for name, value in params.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise quote_error(400, "%s.%s must be a number." % (kind, name))
+        try:
+            va_core.check_params(kind, params)
+        except ValueError as e:
+            raise quote_error(400, "%s: %s" % (kind, e))
+        scenarios[kind] = params
+    if not scenarios:
+        raise quote_error(400, "Give scenario1 and/or scenario2.")
+    years_dist = request.get('years_dist', 10)
+    if isinstance(years_dist, bool) or not isinstance(years_dist, int) or not 1 <= years_dist <= 60:
+        raise quote_error(400, "years_dist must be an integer from 1 to 60.")
+    deadline_ms = request.get('deadline_ms', DEFAULT_DEADLINE_MS)
+    if isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float)) or not deadline_ms > 0:
+        raise quote_error(400, "deadline_ms must be a positive number.")
+    return scenarios, years_dist, deadline_ms
+
+
+class quote_service(object):
+    def __init__(self, workers=None, executor=None):
+        """
+        workers is the size of the process pool. Pass executor to use your
+        own (e.g. a ThreadPoolExecutor in an environment without fork).
+        """
+        if executor is None:
+            #Workers must not be forked from the serving process, or they would
+            #inherit open client sockets and hold those connections open.
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+        self.executor = executor
+        #solve key -> (budget, future) of the solve requests with that key join
+        self.inflight = {}
+        self.solves = 0
+        self.coalesced = 0
+
+    def solve(self, kind, params, years_dist, budget):
+        """
+        Returns a future for the solve. An identical solve already in flight
+        is joined if it was given at least this request's budget, so a long
+        budget never gets the result of a solve started with a shorter one.
+        """
+        key = json.dumps([kind, sorted(params.items()), years_dist])
+        entry = self.inflight.get(key)
+        if entry is not None and entry[0] >= budget:
+            self.coalesced += 1
+            return entry[1]
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, quote_scenario, kind, params, years_dist,
+                                      time.monotonic() + budget)
+        self.solves += 1
+        #The longer solve takes the key, so later requests join it.
+        self.inflight[key] = (budget, future)
+
+        def done(f):
+            if self.inflight.get(key, (None, None))[1] is f:
+                del self.inflight[key]
+        future.add_done_callback(done)
+        return future
+
+    async def quote(self, body):
+        scenarios, years_dist, deadline_ms = parse_quote(body)
+        budget = deadline_ms / 1000
+        futures = {kind: self.solve(kind, params, years_dist, budget) for kind, params in scenarios.items()}
+        try:
+            #shield, so one request timing out does not cancel a solve others share.
+            results = await asyncio.wait_for(asyncio.gather(*[asyncio.shield(f) for f in futures.values()]), budget)
+        except asyncio.TimeoutError:
+            raise quote_error(504, "No result within %s ms." % deadline_ms)
+        except (ArithmeticError, IndexError):
+            #Parameters within range that the original arithmetic still cannot solve.
+            logger.exception("Quote could not be solved.")
+            raise quote_error(422, "These parameters cannot be solved.")
+        if None in results:
+            #Skipped by a worker: its solve was still queued at the deadline.
+            raise quote_error(504, "No result within %s ms." % deadline_ms)
+        out = dict(zip(futures, results))
+        if len(out) == 2:
+            compare = va_core.after_tax_compare(out['scenario1']['dist_info'], out['scenario2']['dist_info'])
+            out['after_tax_compare'] = compare
+        return out
+
+    async def handle(self, reader, writer):
+        try:
+            status, payload = await self.respond(reader)
+        except quote_error as e:
+            status, payload = e.status, {'error': str(e)}
+        except Exception:
+            logger.exception("Quote failed.")
+            status, payload = 500, {'error': "Quote failed."}
+        body = json.dumps(payload).encode('utf-8')
+        writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n'
+                      'Connection: close\r\n\r\n' % (status, STATUS[status], len(body))).encode('latin-1') + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def respond(self, reader):
+        request_line = await reader.readline()
+        try:
+            method, path, version = request_line.decode('latin-1').split()
+        except ValueError:
+            raise quote_error(400, "Malformed request line.")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise quote_error(400, "Bad Content-Length.")
+        if length > MAX_BODY:
+            raise quote_error(413, "Body too large.")
+        body = await reader.readexactly(length) if length else b''
+        path = path.split('?', 1)[0]
+        if path == '/health':
+            return 200, {'status': 'ok', 'solves': self.solves, 'coalesced': self.coalesced, 'inflight': len(self.inflight)}
+        if path != '/quote':
+            raise quote_error(404, "Unknown path %s." % path)
+        if method != 'POST':
+            raise quote_error(405, "Use POST for /quote.")
+        return 200, await self.quote(body)
+
+    async def start(self, host='127.0.0.1', port=8765):
+        """Starts listening and returns the asyncio server (port=0 picks a free port)."""
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+async def serve(host='127.0.0.1', port=8765, workers=None):
+    service = quote_service(workers)
+    server = await service.start(host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Local quoting service.')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8765)
+    parser.add_argument('--workers', type = int, help = 'Solver processes, defaults to the CPU count.')
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.workers))
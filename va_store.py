@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar result store for scenario runs.
+
+One run (or one batch of clients) is written to a single binary file instead
+of a handful of CSVs per client. Each DataFrame is stored as a partition,
+keyed by table name, client and scenario. Columns are kept as raw float64 /
+int64 arrays so dtypes survive the round trip, and they can be read back
+memory-mapped, one column at a time.
+
+File layout:
+
+    b'VASTORE1'
+    column blocks, each aligned to 64 bytes
+    JSON footer (metadata + partition/column offsets)
+    footer length (8 bytes, little endian) + b'VASTORE1'
+
+The footer sits at the end so partitions can be appended as they are
+computed, without knowing the size of the run in advance. Until then the
+partition entries wait in a temporary file, not in memory, so writing a
+large batch takes the same memory as writing a small one. A writer left by
+an exception (abort()) gets no footer, so the half-written file reads as
+truncated rather than as a complete store.
+"""
+
+import json
+import struct
+import tempfile
+
+import numpy as np
+
+MAGIC = b'VASTORE1'
+ALIGN = 64
+STORE_VERSION = 1
+
+#Only fixed width numeric columns go in the store.
+_KINDS = 'biuf'
+
+
+class store_writer(object):
+    def __init__(self, path, metadata=None):
+        """
+        Opens path for writing and starts a new store.
+
+        metadata is a dict of run level information (tax schedule version,
+        parameters, etc.) that is saved in the footer. It must be JSON
+        serializable.
+        """
+        self.path = path
+        self.metadata = dict(metadata or {})
+        self.npartitions = 0
+        #one JSON line per partition entry, copied into the footer by close()
+        self._spool = tempfile.TemporaryFile('w+', encoding='utf-8')
+        self._fh = open(path, 'wb')
+        self._fh.write(MAGIC)
+        self._pos = len(MAGIC)
+
+    def _write_column(self, name, values):
+        values = np.ascontiguousarray(values)
+        if values.dtype.kind not in _KINDS:
+            raise ValueError("Column %r has dtype %s, only numeric columns can be stored." % (name, values.dtype))
+        #pad up to the next aligned offset so np.memmap can map it directly
+        pad = (-self._pos) % ALIGN
+        self._fh.write(b'\x00' * pad)
+        self._pos += pad
+        offset = self._pos
+        data = values.astype(values.dtype.newbyteorder('<'), copy=False).tobytes()
+        self._fh.write(data)
+        self._pos += len(data)
+        return {'name': name, 'dtype': values.dtype.newbyteorder('<').str, 'offset': offset}
+
+    def append(self, table, data, client=None, scenario=None, params=None, attrs=None):
+        """
+        Appends one partition.
+
+        data is either a DataFrame (its index is stored as well, under the
+        index name) or a dict of column name -> 1-D array. attrs is an
+        optional JSON serializable dict kept with the partition (e.g. the
+        error of a failed client).
+        """
+        if hasattr(data, 'columns'):
+            index_name = data.index.name or 'index'
+            columns = [(index_name, np.asarray(data.index))]
+            columns += [(str(col), np.asarray(data[col])) for col in data.columns]
+        else:
+            index_name = None
+            columns = [(str(col), np.asarray(values)) for col, values in data.items()]
+        nrows = len(columns[0][1]) if columns else 0
+        for name, values in columns:
+            if len(values) != nrows:
+                raise ValueError("Column %r has %d rows, expected %d." % (name, len(values), nrows))
+        part = {
+            'table': table,
+            'client': client,
+            'scenario': scenario,
+            'params': dict(params or {}),
+            'nrows': nrows,
+            'index': index_name,
+            'columns': [self._write_column(name, values) for name, values in columns],
+        }
+        if attrs is not None:
+            part['attrs'] = dict(attrs)
+        self._spool.write(json.dumps(part) + '\n')
+        self.npartitions += 1
+
+    def close(self):
+        if self._fh is None:
+            return
+        #The footer is the JSON object {"version", "metadata", "partitions": [...]},
+        #written a partition at a time from the spool.
+        head = json.dumps({'version': STORE_VERSION, 'metadata': self.metadata})
+        footer_len = self._write_footer(head[:-1] + ', "partitions": [')
+        self._spool.seek(0)
+        for i, line in enumerate(self._spool):
+            footer_len += self._write_footer((',' if i else '') + line.rstrip('\n'))
+        footer_len += self._write_footer(']}')
+        self._fh.write(struct.pack('<Q', footer_len))
+        self._fh.write(MAGIC)
+        self._fh.close()
+        self._fh = None
+        self._spool.close()
+
+    def abort(self):
+        """Closes the file without a footer, for a run that failed part way."""
+        if self._fh is None:
+            return
+        self._fh.close()
+        self._fh = None
+        self._spool.close()
+
+    def _write_footer(self, text):
+        data = text.encode('utf-8')
+        self._fh.write(data)
+        return len(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def store_info(path):
+    """
+    Returns the footer of a store: version, run metadata and the list of
+    partitions with their column offsets. No column data is read.
+    """
+    with open(path, 'rb') as fh:
+        if fh.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a result store." % path)
+        if fh.seek(0, 2) < 2*len(MAGIC) + 8:
+            raise ValueError("%s is truncated, the store was not closed." % path)
+        fh.seek(-(8 + len(MAGIC)), 2)
+        footer_len = struct.unpack('<Q', fh.read(8))[0]
+        if fh.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is truncated, the store was not closed." % path)
+        fh.seek(-(8 + len(MAGIC) + footer_len), 2)
+        return json.loads(fh.read(footer_len).decode('utf-8'))
+
+
+def read_store(path, table=None, client=None, scenario=None, columns=None, as_frame=True):
+    """
+    Loads partitions from a store, filtered by table, client and scenario.
+
+    Columns are memory-mapped, so only the columns asked for are touched.
+    Returns a dict keyed by (table, client, scenario). Values are DataFrames
+    when as_frame is True, otherwise dicts of read-only memmapped arrays.
+    """
+    info = store_info(path)
+    out = {}
+    for part in info['partitions']:
+        if table is not None and part['table'] != table:
+            continue
+        if client is not None and part['client'] != client:
+            continue
+        if scenario is not None and part['scenario'] != scenario:
+            continue
+        arrays = {}
+        for col in part['columns']:
+            if columns is not None and col['name'] not in columns and col['name'] != part['index']:
+                continue
+            if part['nrows'] == 0:
+                arrays[col['name']] = np.empty(0, dtype=col['dtype'])
+            else:
+                arrays[col['name']] = np.memmap(path, dtype=col['dtype'], mode='r',
+                                                offset=col['offset'], shape=(part['nrows'],))
+        key = (part['table'], part['client'], part['scenario'])
+        out[key] = _to_frame(arrays, part['index']) if as_frame else arrays
+    return out
+
+
+def _to_frame(arrays, index_name):
+    import pandas as pd
+    if index_name is None:
+        return pd.DataFrame(arrays)
+    index = pd.Index(arrays.pop(index_name), name=index_name)
+    return pd.DataFrame(arrays, index=index, columns=list(arrays))
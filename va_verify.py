@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Differential verification: fast engine (va_core) against the reference
+scenario classes (total_returns, distributions/goal_seek).
+
+For each sampled client three things are checked:
+
+1) first10: va_core.first10 against total_returns(), column by column.
+2) kernel: va_core.simulate at the distribution goal_seek settled on,
+   against dist_df and dist_info. This covers the goal_seek quirks (the
+   `remain_dist_needed > 0 & (...)` precedence, the final 11th distribution
+   and its tax_list entry, the ZeroDivisionError fallback) and should match
+   to the cent.
+3) solver: the distribution va_core.solve finds against goal_seek's. The
+   reference only stops once the residual rounds to zero dollars, so this
+   gets a looser tolerance. A fast solve that raises where the reference
+   solved counts as a divergence (fast_error).
+
+Sampling is cheap: should_verify(rate) decides per client, and only the
+sampled clients pay for the reference run.
+
+    python va_verify.py --workload roster_20 --fraction 0.1
+"""
+
+import math
+import random
+
+import va_core
+
+
+def column_divergence(ref, fast):
+    """
+    Max absolute difference per column between two dicts of column lists.
+    NaN in both counts as equal; NaN in one, or a missing row, is inf.
+    """
+    out = {}
+    for col, ref_values in ref.items():
+        fast_values = fast.get(col)
+        if fast_values is None or len(fast_values) != len(ref_values):
+            out[col] = float('inf')
+            continue
+        worst = 0.0
+        for a, b in zip(ref_values, fast_values):
+            a_nan = isinstance(a, float) and math.isnan(a)
+            b_nan = isinstance(b, float) and math.isnan(b)
+            if a_nan and b_nan:
+                continue
+            if a_nan or b_nan:
+                worst = float('inf')
+                break
+            worst = max(worst, abs(a - b))
+        out[col] = worst
+    return out
+
+
+def verify_client(kind, params=None, years_dist=10, tolerance=0.01, solve_tolerance=1.0):
+    """
+    Runs the reference and fast paths for one client and compares them.
+
+    kind is 'scenario1' or 'scenario2', params the constructor arguments.
+    Returns a report dict; report['ok'] is False if any column diverges by
+    more than tolerance, or the solved distributions differ by more than
+    solve_tolerance.
+    """
+    from va_batch import make_client, frame_columns
+    params = dict(params or {})
+    client = make_client(kind, **params)
+    ref_first10 = client.total_returns()
+    ref_dists, ref_info = client.distributions(years_dist)
+    ref_distribution = float(ref_info['dists'].iloc[0])
+
+    p = dict(va_core.DEFAULTS[kind])
+    p.update(params)
+    rates = va_core.rates_of(p)
+    fast_first10 = va_core.first10(kind, p)
+    start = va_core.start_state(fast_first10)
+    sim = va_core.simulate(kind, rates, start, ref_distribution, years_dist)
+    fast_dists, fast_info = va_core.dist_tables(sim)
+
+    columns = {}
+    for table, ref, fast in (('first10', frame_columns(ref_first10), fast_first10),
+                             ('dists', frame_columns(ref_dists), fast_dists),
+                             ('distributions', frame_columns(ref_info), fast_info)):
+        for col, value in column_divergence(ref, fast).items():
+            columns['%s.%s' % (table, col)] = value
+    max_divergence = max(columns.values())
+
+    failures = sorted(col for col, value in columns.items() if value > tolerance)
+    try:
+        fast_distribution, fast_sim, evaluations, converged = va_core.solve(kind, rates, start, years_dist)
+    except Exception as e:
+        fast_distribution, evaluations, converged = float('nan'), 0, False
+        failures.append('fast_error: %s: %s' % (type(e).__name__, e))
+    distribution_divergence = abs(fast_distribution - ref_distribution)
+    if math.isnan(distribution_divergence):
+        distribution_divergence = float('inf')
+    elif distribution_divergence > solve_tolerance:
+        failures.append('distribution')
+    if not converged and not math.isinf(distribution_divergence):
+        failures.append('fast_not_converged')
+    return {'scenario': kind,
+            'params': params,
+            'columns': columns,
+            'max_divergence': max_divergence,
+            'tolerance': tolerance,
+            'reference_distribution': ref_distribution,
+            'fast_distribution': fast_distribution,
+            'distribution_divergence': distribution_divergence,
+            'solve_tolerance': solve_tolerance,
+            'fast_evaluations': evaluations,
+            'reference_simulations': client.metrics.simulations,
+            'failures': failures,
+            'ok': not failures}
+
+
+def should_verify(rate, rng=random):
+    """True for roughly rate (0-1) of calls."""
+    return rate > 0 and rng.random() < rate
+
+
+def verify_sample(specs, fraction=0.01, seed=None, **kwargs):
+    """
+    Verifies a random fraction of (scenario, params) specs.
+    Returns (reports, summary) where summary has the worst divergences seen.
+    """
+    rng = random.Random(seed)
+    reports = [verify_client(kind, params, **kwargs) for kind, params in specs if should_verify(fraction, rng)]
+    summary = {'sampled': len(reports),
+               'total': len(specs),
+               'failed': sum(1 for r in reports if not r['ok']),
+               'max_divergence': max([r['max_divergence'] for r in reports] or [0.0]),
+               'max_distribution_divergence': max([r['distribution_divergence'] for r in reports] or [0.0])}
+    return reports, summary
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from va_benchmark import WORKLOADS, HORIZONS, DEFAULT_HORIZON
+    parser = argparse.ArgumentParser(description = 'Compare the fast engine against the reference goal_seek.')
+    #the reference runs 10/10 year horizons only
+    parser.add_argument('--workload', default = 'default',
+                        choices = sorted(name for name in WORKLOADS if HORIZONS[name] == DEFAULT_HORIZON))
+    parser.add_argument('--fraction', type = float, default = 1.0, help = 'Share of clients to verify (0-1).')
+    parser.add_argument('--seed', type = int)
+    parser.add_argument('--tolerance', type = float, default = 0.01)
+    parser.add_argument('--solve-tolerance', type = float, default = 1.0)
+    args = parser.parse_args()
+
+    reports, summary = verify_sample(WORKLOADS[args.workload](), args.fraction, args.seed,
+                                     tolerance = args.tolerance, solve_tolerance = args.solve_tolerance)
+    for r in reports:
+        print("%s %s max divergence %.6f, distribution %.2f vs %.2f: %s" % (r['scenario'], r['params'], r['max_divergence'],
+              r['reference_distribution'], r['fast_distribution'], 'ok' if r['ok'] else ', '.join(r['failures'])))
+    print(json.dumps(summary, indent = 2))
+    if summary['failed']:
+        raise SystemExit(1)